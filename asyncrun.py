@@ -1,10 +1,138 @@
 import asyncio
+import atexit
+import json
+import os
+import re
 import subprocess
+import tempfile
+import time
+import weakref
+import sniffio
 import trio
 from loguru import logger
-from typing import List
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 log = logger
 
+max_concurrent: int = 2 * (os.cpu_count() or 4)  # How many commands may run at the same time, per event loop.
+# Keyed by the asyncio loop or the trio run's token, so a limiter goes away with its loop.
+_limiters: 'weakref.WeakKeyDictionary[Any, Any]' = weakref.WeakKeyDictionary()
+
+try:
+    trio_lowlevel = trio.lowlevel  # type: ignore
+except AttributeError:  # trio before 0.15
+    trio_lowlevel = trio.hazmat  # type: ignore
+trio_open_process = getattr(trio_lowlevel, 'open_process', None) or trio.open_process  # Moved in trio 0.20
+
+
+class CommandStats:
+    """The collected measurements of one kind of command, like rclone lsjson."""
+    buckets = (0.01, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0, float('inf'))  # Upper bounds of the wall time histogram
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.stdout_bytes = 0
+        self.max_concurrency = 0
+        self.histogram = [0] * len(self.buckets)
+
+    def add(self, wall_time: float, returncode: Optional[int], stdout_bytes: int, concurrency: int) -> None:
+        self.count += 1
+        if returncode != 0:
+            self.failures += 1
+        self.total_time += wall_time
+        self.max_time = max(self.max_time, wall_time)
+        self.stdout_bytes += stdout_bytes
+        self.max_concurrency = max(self.max_concurrency, concurrency)
+        for index, bound in enumerate(self.buckets):
+            if wall_time <= bound:
+                self.histogram[index] += 1
+                break
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'count': self.count, 'failures': self.failures, 'total_time': self.total_time,
+                'mean_time': self.total_time / self.count if self.count else 0.0, 'max_time': self.max_time,
+                'stdout_bytes': self.stdout_bytes, 'max_concurrency': self.max_concurrency,
+                'histogram': {("inf" if bound == float('inf') else str(bound)): amount
+                              for bound, amount in zip(self.buckets, self.histogram)}}
+
+
+class Profiler:
+    """Records wall time, exit status, stdout size and concurrency of every command run through this module.
+    It is off by default and then costs a single attribute check per command.
+    Turn it on with enable() or by setting the environment variable ASYNCRUN_PROFILE."""
+
+    def __init__(self):
+        self.enabled = False
+        self.running = 0
+        self.stats: Dict[str, CommandStats] = {}
+        self._registered = False
+        self._export_path: Optional[str] = None
+
+    def enable(self, dump_at_exit: bool = False, export_path: Optional[str] = None) -> None:
+        """Starts recording.
+        :param dump_at_exit Whether to log the summary table when the process exits.
+        :param export_path Where to write the JSON export when the process exits."""
+        self.enabled = True
+        self._export_path = export_path
+        if (dump_at_exit or export_path) and not self._registered:
+            atexit.register(self._at_exit, dump_at_exit)
+            self._registered = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        self.stats.clear()
+
+    def record(self, command: List[str], wall_time: float, returncode: Optional[int], stdout_bytes: int,
+               concurrency: int) -> None:
+        key = command_key(command)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = CommandStats()
+        stats.add(wall_time, returncode, stdout_bytes, concurrency)
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {key: stats.as_dict() for key, stats in sorted(self.stats.items())}
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2)
+
+    def export(self, path: str) -> None:
+        with open(path, 'w') as file:
+            file.write(self.to_json())
+
+    def summary(self) -> str:
+        """Formats the measurements as a table, the commands that took the most time in total first."""
+        lines = [f"{'command':<24}{'count':>7}{'failed':>7}{'total s':>10}{'mean s':>9}{'max s':>9}"
+                 f"{'stdout MB':>11}{'max par':>8}"]
+        for key, stats in sorted(self.stats.items(), key=lambda entry: -entry[1].total_time):
+            lines.append(f"{key:<24}{stats.count:>7}{stats.failures:>7}{stats.total_time:>10.2f}"
+                         f"{stats.total_time / stats.count:>9.3f}{stats.max_time:>9.2f}"
+                         f"{stats.stdout_bytes / 1024 / 1024:>11.2f}{stats.max_concurrency:>8}")
+        return "\n".join(lines)
+
+    def _at_exit(self, dump: bool) -> None:
+        if dump and self.stats:
+            log.info("Subprocess profile:\n" + self.summary())
+        if self._export_path:
+            self.export(self._export_path)
+
+
+def command_key(command: List[str]) -> str:
+    """Groups commands by program and subcommand, so rclone lsjson and rclone md5sum are told apart."""
+    program = os.path.basename(command[0])
+    if len(command) > 1 and re.match(r'^[a-z][a-z0-9]*$', command[1]):
+        return f"{program} {command[1]}"
+    return program
+
+
+profiler = Profiler()
+if os.environ.get('ASYNCRUN_PROFILE'):
+    profiler.enable(dump_at_exit=True, export_path=os.environ.get('ASYNCRUN_PROFILE_JSON'))
+
 
 async def convert_args_to_str(*args) -> List[str]:
     newargs: List[str] = []
@@ -15,32 +143,208 @@ async def convert_args_to_str(*args) -> List[str]:
             newargs.append(arg)
     return newargs
 
-async def _asyncrun_trio(cmd: str, args: List[str]) -> str:
-    command: List[str] = [cmd]
-    command.extend(args)
-    out = await trio.run_process(command=command, capture_stdout=True)
-    return out.stdout
 
+def set_concurrency_limit(limit: int) -> None:
+    """Sets how many commands may run at the same time. Commands that are already waiting keep the old limit."""
+    global max_concurrent
+    max_concurrent = limit
+    _limiters.clear()
 
-async def asyncrun_trio(cmd: str, *args) -> str:
-    log.debug(f"Using trio to run cmd {cmd} with {list(args)}")
-    newargs = await convert_args_to_str(*args)
-    out = trio.run(_asyncrun_trio, cmd, newargs)
-    return out
 
-async def asyncrun(cmd: str, *args) -> str:
-    """Runs the given command, connects stdout to the current shell and waits until it is completed"""
+def _limiter() -> Tuple[str, Any]:
+    """Returns the running async library and the limiter shared by all commands on the current event loop."""
+    library = sniffio.current_async_library()
+    if library == 'trio':
+        key = trio_lowlevel.current_trio_token()
+    else:
+        key = asyncio.get_event_loop()
+    limiter = _limiters.get(key)
+    if limiter is None:
+        if library == 'trio':
+            limiter = trio.CapacityLimiter(max_concurrent)
+        else:
+            limiter = asyncio.Semaphore(max_concurrent)
+        _limiters[key] = limiter
+    return library, limiter
+
+
+async def _run(command: List[str], timeout: Optional[float]) -> str:
+    """Runs the command on the caller's event loop and returns its stdout.
+    :raises subprocess.CalledProcessError with the captured stderr, if the command fails.
+    :raises subprocess.TimeoutExpired if it takes longer than timeout seconds, the command gets killed then."""
+    library, limiter = _limiter()
+    async with limiter:
+        profiler.running += 1
+        started = time.perf_counter() if profiler.enabled else 0.0
+        returncode = None
+        stdout = b''
+        try:
+            returncode, stdout, stderr = await _run_process(library, command, timeout)
+        finally:
+            profiler.running -= 1
+            if profiler.enabled:
+                profiler.record(command, time.perf_counter() - started, returncode, len(stdout), profiler.running + 1)
+    if returncode != 0:
+        log.error(f"{command[0]} failed with exit code {returncode}: {stderr.decode(errors='replace').strip()}")
+        raise subprocess.CalledProcessError(returncode, command, stdout, stderr)
+    return stdout.decode()
+
+
+async def _run_process(library: str, command: List[str], timeout: Optional[float]) -> Tuple[int, bytes, bytes]:
+    if library == 'trio':
+        try:
+            with trio.fail_after(timeout if timeout is not None else float('inf')):
+                result = await trio.run_process(command, capture_stdout=True, capture_stderr=True, check=False)
+        except trio.TooSlowError:
+            raise subprocess.TimeoutExpired(command, timeout)
+        return result.returncode, result.stdout, result.stderr
+    proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(command, timeout)
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+    return proc.returncode, stdout, stderr
+
+
+async def asyncrun(cmd: str, *args, timeout: Optional[float] = None) -> str:
+    """Runs the given command without blocking the event loop and returns its stdout once it is completed."""
     log.info(f"Running cmd {cmd} with {list(args)}")
-    return await asyncrun_trio(cmd, *args)
+    newargs = await convert_args_to_str(*args)
+    return await _run([cmd, *newargs], timeout)
 
 
-async def asyncrun_quiet(cmd: str, *args) -> str:
+async def asyncrun_quiet(cmd: str, *args, timeout: Optional[float] = None) -> str:
     """Runs the given command quietly and waits until it is completed."""
     log.debug(f"Quietly Running cmd {cmd} with {list(args)}")
     newargs: List[str] = await convert_args_to_str(*args)
-    proc = await asyncio.subprocess.create_subprocess_exec(cmd, *newargs, stdout=asyncio.subprocess.PIPE,
-                                                           stderr=asyncio.subprocess.DEVNULL)
-    out = await proc.stdout.read()
-    out = out.decode().rstrip()
-    await proc.wait()
-    return out
+    out = await _run([cmd, *newargs], timeout)
+    return out.rstrip()
+
+
+async def asyncrun_stream(cmd: str, *args, chunk_size: int = 64 * 1024, timeout: Optional[float] = None,
+                          limited: bool = True) -> AsyncIterator[bytes]:
+    """Runs the given command and yields its stdout in chunks as soon as they arrive.
+    stderr goes to a temporary file, so it can't fill up while nobody reads it, and is attached to the error.
+    :param limited Whether the command counts against the concurrency limit for as long as it runs.
+    Turn it off for commands that run for hours, like encodes, so they don't hold up short ones.
+    :raises subprocess.CalledProcessError if the command fails.
+    :raises subprocess.TimeoutExpired if it runs longer than timeout seconds in total."""
+    log.debug(f"Streaming cmd {cmd} with {list(args)}")
+    command = [cmd, *await convert_args_to_str(*args)]
+    library, limiter = _limiter()
+    async with (limiter if limited else _Unlimited()), _TemporaryFile() as stderr:
+        if library == 'trio':
+            chunks = _stream_trio(command, stderr, chunk_size, timeout)
+        else:
+            chunks = _stream_asyncio(command, stderr, chunk_size, timeout)
+        profiler.running += 1
+        started = time.perf_counter() if profiler.enabled else 0.0
+        returncode = None
+        stdout_bytes = 0
+        try:
+            async for chunk in chunks:
+                if isinstance(chunk, int):
+                    returncode = chunk
+                    break
+                stdout_bytes += len(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()  # Kills the command if we stopped reading early.
+            profiler.running -= 1
+            if profiler.enabled:
+                profiler.record(command, time.perf_counter() - started, returncode, stdout_bytes,
+                                profiler.running + 1)
+        if returncode != 0:
+            stderr.seek(0)
+            error = stderr.read()
+            log.error(f"{cmd} failed with exit code {returncode}: {error.decode(errors='replace').strip()}")
+            raise subprocess.CalledProcessError(returncode, command, None, error)
+
+
+class _Unlimited:
+    """Stands in for the limiter of commands that don't count against it."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class _TemporaryFile:
+    """tempfile.TemporaryFile as an async context manager, so it can share the async with of the limiter."""
+
+    async def __aenter__(self):
+        self._file = tempfile.TemporaryFile()
+        return self._file
+
+    async def __aexit__(self, *exc_info):
+        self._file.close()
+
+
+async def _stream_asyncio(command: List[str], stderr, chunk_size: int, timeout: Optional[float]):
+    """Yields the stdout chunks of the command and finally its exit code."""
+    proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=stderr)
+    deadline = None if timeout is None else asyncio.get_event_loop().time() + timeout
+    try:
+        while True:
+            remaining = None if deadline is None else deadline - asyncio.get_event_loop().time()
+            try:
+                chunk = await asyncio.wait_for(proc.stdout.read(chunk_size), remaining)
+            except asyncio.TimeoutError:
+                raise subprocess.TimeoutExpired(command, timeout)
+            if not chunk:
+                break
+            yield chunk
+        yield await proc.wait()
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+async def _stream_trio(command: List[str], stderr, chunk_size: int, timeout: Optional[float]):
+    """Yields the stdout chunks of the command and finally its exit code."""
+    proc = await trio_open_process(command, stdout=subprocess.PIPE, stderr=stderr)
+    deadline = float('inf') if timeout is None else trio.current_time() + timeout
+    try:
+        while True:
+            try:
+                with trio.fail_at(deadline):
+                    chunk = await proc.stdout.receive_some(chunk_size)
+            except trio.TooSlowError:
+                raise subprocess.TimeoutExpired(command, timeout)
+            if not chunk:
+                break
+            yield chunk
+        yield await proc.wait()
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            with trio.CancelScope(shield=True):
+                await proc.wait()
+
+
+async def asyncrun_lines(cmd: str, *args, separators: bytes = b'\n', timeout: Optional[float] = None,
+                         limited: bool = True) -> AsyncIterator[str]:
+    """Runs the given command and yields its stdout line by line instead of buffering all of it.
+    :param separators Every one of these bytes ends a line, progress output often needs b'\\r\\n'.
+    :param limited See asyncrun_stream."""
+    split = re.compile(b'[' + re.escape(separators) + b']').split
+    rest = b''
+    chunks = asyncrun_stream(cmd, *args, timeout=timeout, limited=limited)
+    try:
+        async for chunk in chunks:
+            rest += chunk
+            *lines, rest = split(rest)
+            for line in lines:
+                yield line.decode(errors='replace')
+    finally:
+        await chunks.aclose()  # Kills the command right away if we stopped reading early.
+    if rest:
+        yield rest.decode(errors='replace')
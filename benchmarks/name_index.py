@@ -0,0 +1,74 @@
+"""Compares the NameIndex searches to a linear scan over a synthetic tree.
+Run from the repository root with: python -m benchmarks.name_index [AMOUNT]"""
+import sys
+import time
+from typing import Callable, List
+
+import rclone
+from rclone_index import NameIndex
+
+drive = "Drive:"
+files_per_folder = 1000
+words = ["Holiday", "Birthday", "Concert", "Interview", "Lecture", "Tutorial", "Trailer", "Episode"]
+extensions = [".mkv", ".mp4", ".mov", ".avi", ".srt"]
+
+
+def make_tree(amount: int) -> rclone.RcloneDirectory:
+    root = rclone.RcloneDirectory({'Path': "", 'Name': "", 'IsDir': True}, drive, "")
+    builder = rclone.TreeBuilder(root)
+    for folder in range(max(amount // files_per_folder, 1)):
+        builder.add(rclone.RcloneDirectory({'Path': f"Folder {folder}", 'Name': f"Folder {folder}", 'IsDir': True},
+                                           drive, ""))
+    for i in range(amount):
+        name = f"{words[i % len(words)]} {i}{extensions[i % len(extensions)]}"
+        builder.add(rclone.RcloneFile({'Path': f"Folder {i // files_per_folder}/{name}", 'Name': name, 'Size': i,
+                                       'MimeType': "video/x-matroska", 'IsDir': False}, drive, ""))
+    return builder.finish()
+
+
+def linear(root: rclone.RcloneDirectory, matches: Callable[[str], bool]) -> List[rclone.RcloneItem]:
+    """The way RcloneDirectory.find works, extended to the whole tree and all matches."""
+    results = []
+    stack = [root]
+    while stack:
+        for item in stack.pop()._contents:
+            if matches(item.name.lower()):
+                results.append(item)
+            if isinstance(item, rclone.RcloneDirectory):
+                stack.append(item)
+    return results
+
+
+def timed(function: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main(amount: int = 1000000) -> None:
+    import fnmatch
+    import re
+    root = make_tree(amount)
+    build = timed(lambda: NameIndex(root))
+    index = NameIndex(root)
+    print(f"{amount} items, building the index took {build:.2f}s")
+    queries = [
+        ("substring '123456'", lambda: index.search("123456"), lambda name: "123456" in name),
+        ("substring 'concert 9'", lambda: index.search("Concert 9"), lambda name: "concert 9" in name),
+        ("glob '*.srt'", lambda: index.glob("*.srt"), lambda name: fnmatch.fnmatch(name, "*.srt")),
+        ("glob 'lecture 77*.mkv'", lambda: index.glob("Lecture 77*.mkv"),
+         lambda name: fnmatch.fnmatch(name, "lecture 77*.mkv")),
+        ("regex 'trailer 4\\d{2}\\.'", lambda: index.regex(r"trailer 4\d{2}\."),
+         lambda name: re.search(r"trailer 4\d{2}\.", name) is not None),
+    ]
+    print(f"{'query':<28}{'index':>10}{'linear':>10}")
+    for name, indexed, matches in queries:
+        assert len(indexed()) == len(linear(root, matches))
+        print(f"{name:<28}{timed(indexed):>9.4f}s{timed(lambda: linear(root, matches)):>9.4f}s")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        main(int(sys.argv[1]))
+    else:
+        main()
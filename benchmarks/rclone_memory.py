@@ -0,0 +1,71 @@
+"""Measures how many bytes a listing of rclone items needs per entry.
+Run from the repository root with: python -m benchmarks.rclone_memory [AMOUNT]"""
+import gc
+import sys
+import tracemalloc
+from pathlib import PurePosixPath
+from typing import Callable, List
+
+import rclone
+
+drive = "Drive:"
+folders = 1000
+
+
+class LegacyFile:
+    """The representation RcloneFile had before it used __slots__, kept here for comparison."""
+
+    def __init__(self, item, drive: str, path):
+        self._item = item
+        self._orig_path = path
+        self.drive = drive
+        self.path = PurePosixPath(path, item['Path'])
+        self.fullpath = PurePosixPath(drive, self.path)
+        self.name = item['Name']
+        self.parent = self.path.parent
+        self.is_directory = False
+        self.filetype = item['MimeType']
+        self.purename = self.path.stem
+        self.extension = self.path.suffix
+        self._size = int(item['Size'])
+
+
+def make_entries(amount: int) -> List[dict]:
+    return [{'Path': f"Folder {i % folders}/Some Video File {i}.mkv", 'Name': f"Some Video File {i}.mkv",
+             'Size': 1024 * i, 'MimeType': "video/x-matroska", 'ModTime': "2019-12-24T18:00:00.000000000Z",
+             'IsDir': False} for i in range(amount)]
+
+
+def measure(name: str, amount: int, build: Callable[[List[dict]], object]) -> None:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    entries = make_entries(amount)
+    result = build(entries)
+    del entries  # Whatever still references the decoded JSON keeps it alive, everything else is freed.
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"{name:<28}{used / amount:>10.1f} bytes per item")
+    del result
+
+
+def build_listing(entries: List[dict]) -> rclone.RcloneListing:
+    listing = rclone.RcloneListing(drive)
+    for entry in entries:
+        listing.append(entry)
+    return listing
+
+
+def main(amount: int = 100000) -> None:
+    print(f"{amount} files in {folders} folders:")
+    measure("dict attributes (before)", amount, lambda entries: [LegacyFile(e, drive, "") for e in entries])
+    measure("RcloneFile with __slots__", amount, lambda entries: [rclone.RcloneFile(e, drive, "") for e in entries])
+    measure("RcloneListing (columnar)", amount, build_listing)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        main(int(sys.argv[1]))
+    else:
+        main()
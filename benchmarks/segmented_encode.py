@@ -0,0 +1,54 @@
+"""Compares the wall time of a single HandBrakeCLI run to the segmented encode on a generated test clip.
+Needs HandBrakeCLI, ffmpeg and ffprobe. The speedup only shows on a host with many cores,
+segmented encoding uses one worker per video_convert.encoder_threads cores by default, so with fewer than twice
+that there is nothing to compare.
+Run from the repository root with: python -m benchmarks.segmented_encode [SECONDS] [WORKERS]"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import video_convert
+from asyncrun import asyncrun, asyncrun_quiet
+
+
+async def make_clip(path: Path, seconds: int) -> None:
+    """A 1080p test pattern with a tone, keyframes every two seconds like most real videos."""
+    await asyncrun_quiet('ffmpeg', '-v', 'error', '-y',
+                         '-f', 'lavfi', '-i', f"testsrc2=size=1920x1080:rate=30:duration={seconds}",
+                         '-f', 'lavfi', '-i', f"sine=frequency=440:duration={seconds}",
+                         '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac', '-shortest', str(path))
+
+
+async def main(seconds: int = 120, workers: Optional[int] = None) -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        clip = Path(folder, 'clip.mkv')
+        await make_clip(clip, seconds)
+        version = ((await asyncrun('HandBrakeCLI', '--version')).strip() or 'HandBrakeCLI').splitlines()[0]
+        if workers is None:
+            workers = max((os.cpu_count() or 1) // video_convert.encoder_threads, 1)
+        print(f"Encoding a {seconds} seconds 1080p clip with {version} on {os.cpu_count()} cores, {workers} workers")
+        if workers < 2:
+            print("Only one worker fits on this host, so the segmented encode can't be faster here.")
+
+        started = time.perf_counter()
+        await video_convert.convert(clip, Path(folder, 'single.mp4'))
+        single = time.perf_counter() - started
+        print(f"single process: {single:8.1f} s")
+
+        started = time.perf_counter()
+        stats = await video_convert.convert_segmented(clip, Path(folder, 'segmented.mp4'), workers=workers)
+        segmented = time.perf_counter() - started
+        print(f"segmented:      {segmented:8.1f} s, {single / segmented:.2f}x faster")
+
+        lengths = [await video_convert.duration(Path(folder, name)) for name in ('single.mp4', 'segmented.mp4')]
+        print(f"output lengths: {lengths[0]:.2f} s and {lengths[1]:.2f} s, "
+              f"{stats.output_bytes / 1024 / 1024:.1f} MB segmented")
+
+
+if __name__ == '__main__':
+    arguments = [int(arg) for arg in sys.argv[1:3]]
+    asyncio.run(main(*arguments))
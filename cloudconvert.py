@@ -1,14 +1,21 @@
 import asyncio
+import asyncrun
+import database
+import json
 import logging
-import pickle
-import pickletools
+import os
+import time
 import pprint
 import rclone
 import video_convert
 import aiofiles.os as asyncos  # type: ignore
+from cloudconvert_coordinator import Coordinator
+from cloudconvert_queue import JobQueue, SchedulingPolicy, policies
+from cloudconvert_stream import StreamMount, TempBudget
+from loguru import logger
 from collections import deque
 from pathlib import *
-from typing import List, Union, NoReturn
+from typing import AbstractSet, Any, Awaitable, Callable, Deque, Dict, Iterable, List, NoReturn, Optional, Set, Union
 
 
 temppath = Path(Path.cwd(), 'tmp')
@@ -16,8 +23,12 @@ basepath = PurePosixPath("Videos/")
 print = pprint.pprint
 logging.basicConfig(level=logging.INFO)
 server: asyncio.AbstractServer
-queue: asyncio.Queue
-running_job: 'Job'
+pipeline: 'Pipeline'
+persist = False  # Whether jobs get stored in the database, see main(resume=...)
+budget: Optional[TempBudget] = None  # Limits the space downloaded inputs take up in the temp folder.
+streamer: Optional[StreamMount] = None  # Set when inputs may be streamed instead of downloaded.
+segment_size: Optional[int] = None  # Inputs bigger than this many bytes get encoded in parallel segments.
+calibrate_speed: Optional[float] = None  # Set to pick the encoder settings with video_convert.calibrate.
 
 
 class Job:
@@ -25,12 +36,20 @@ class Job:
     newext = ".mp4"
     log = logger
 
-    def __init__(self, inputfile: rclone.RcloneFile):
+    def __init__(self, inputfile: rclone.RcloneFile, temppath: Optional[Path] = None):
         self.is_downloaded = False
         self.is_converted = False
         self.is_uploaded = False
+        self.failed = False
         self.inputfile = inputfile
+        if temppath is not None:
+            self._temppath = Path(temppath)
         self.path = Path(self._temppath, self.inputfile.name)
+        self.source = self.path  # What the encoder reads, a path on the rclone mount when streaming.
+        self.reserved = 0
+        self.priority = 0  # Used by the priority scheduling policy, higher goes first.
+        self.progress: Optional[video_convert.Progress] = None  # Of the running encode
+        self.encode: Optional[video_convert.EncodeStats] = None
         self.newfilepath = self.path.with_suffix('.mp4')
         self.parentpath = self.inputfile.fullpath.parent
         self.newname = self.inputfile.purename
@@ -39,26 +58,63 @@ class Job:
         self.log.debug("Inputtfile: " + str(inputfile.path))
 
     async def download(self) -> None:
+        """Downloads the input, or when streaming is enabled and the temp budget is used up,
+        lets the encoder read it straight from the remote instead."""
+        size = self.inputfile._size or 0
+        reserved = budget is None or budget.try_reserve(size)
+        if not reserved and streamer is not None:
+            self.source = await streamer.path(self.inputfile)
+            self.is_downloaded = True
+            self.log.info("Streaming file: " + self.inputfile.name)
+            return
+        if budget is not None:
+            if not reserved:
+                await budget.reserve(size)
+            self.reserved = size
         await rclone.copy(self.inputfile.fullpath, self._temppath)
+        self.source = self.path
         self.is_downloaded = True
         self.log.info("Downloaded file: " + self.inputfile.name)
 
-    async def convert(self) -> None:
+    async def convert(self, on_progress: Optional[Callable[[video_convert.Progress], None]] = None,
+                      cores: Optional[int] = None) -> None:
+        """:param cores How many cores this encode may use, segmented encodes split them between their pieces."""
         if not self.is_downloaded:
             raise FileNotFoundError
+
+        def update(event: video_convert.Progress) -> None:
+            self.progress = event
+            if on_progress is not None:
+                on_progress(event)
+
         self.log.debug("Started conversion of: " + self.inputfile.name)
-        await video_convert.convert(self.path, self.newfilepath)
-        self.log.info("Finished conversion of: " + self.newname)
+        settings: Dict[str, Any] = {}
+        if calibrate_speed is not None:
+            settings = (await video_convert.calibrate(self.source, calibrate_speed)).settings()
+        if segment_size is not None and (self.inputfile._size or 0) > segment_size:
+            self.encode = await video_convert.convert_segmented(self.source, self.newfilepath, on_progress=update,
+                                                                cores=cores, **settings)
+        else:
+            self.encode = await video_convert.convert(self.source, self.newfilepath, on_progress=update, **settings)
+        self.log.info(f"Finished conversion of: {self.newname} in {self.encode.seconds:.0f} seconds, "
+                      f"{self.encode.avg_fps} fps on average")
         self.is_converted = True
 
     async def upload(self) -> None:
         self.log.debug("Starting upload of: " + self.newname)
         await rclone.copy(self.newfilepath, self.parentpath)
+        self.is_uploaded = True
         self.log.info("Finished upload of: " + self.newname)
 
     async def cleanup(self) -> None:
-        await asyncos.remove(self.path)
-        await asyncos.remove(self.newfilepath)
+        for file in (self.path, self.newfilepath):
+            try:
+                await asyncos.remove(file)
+            except FileNotFoundError:  # The job failed before this file got created, or the input was streamed.
+                pass
+        if budget is not None and self.reserved:
+            await budget.release(self.reserved)
+            self.reserved = 0
         # if self.oldext not in ['.mkv', '.mov']:
         # await rclone.delete_file(self.inputfile.fullpath)
 
@@ -68,6 +124,52 @@ class Job:
         await self.upload()
         await self.cleanup()
 
+    def to_dict(self) -> Dict[str, Any]:
+        """The job as plain JSON compatible data, to send it to another machine."""
+        file = self.inputfile
+        return {'drive': file.drive, 'directory': file._parent, 'name': file.name, 'size': file._size,
+                'mimetype': file.filetype, 'modtime': file.modtime, 'hash': file._hash,
+                'downloaded': self.is_downloaded, 'converted': self.is_converted, 'uploaded': self.is_uploaded,
+                'failed': self.failed}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], temppath: Optional[Path] = None) -> 'Job':
+        """Recreates a job from to_dict. The remote it refers to has to be configured in rclone here too."""
+        item = {'Path': data['name'], 'Name': data['name'], 'Size': data['size'], 'MimeType': data['mimetype']}
+        file = rclone.RcloneFile(item, data['drive'], data['directory'])
+        file.modtime = data.get('modtime')
+        file._hash = data.get('hash')
+        job = cls(file, temppath)
+        job.is_downloaded = data.get('downloaded', False)
+        job.is_converted = data.get('converted', False)
+        job.is_uploaded = data.get('uploaded', False)
+        job.failed = data.get('failed', False)
+        return job
+
+    @classmethod
+    def from_record(cls, record: database.JobRecord) -> 'Job':
+        return cls.from_dict(database.model_to_dict(record))
+
+    def save(self) -> None:
+        """Stores the job and how far it got in the database, if jobs are persisted."""
+        if persist:
+            database.JobRecord.replace(fullpath=str(self.inputfile.fullpath), **self.to_dict()).execute()
+
+    def status(self) -> Dict[str, Any]:
+        """The short form of the job that status clients get."""
+        status = {'path': str(self.inputfile.fullpath), 'size': self.inputfile._size, 'downloaded': self.is_downloaded,
+                  'converted': self.is_converted, 'uploaded': self.is_uploaded, 'failed': self.failed}
+        if self.progress is not None and not self.is_converted:
+            status['progress'] = self.progress._asdict()
+        return status
+
+    def check_files(self) -> None:
+        """Forgets about finished stages whose output isn't in the temp folder anymore."""
+        if self.is_converted and not self.newfilepath.exists():
+            self.is_converted = False
+        if self.is_downloaded and not self.is_converted and not self.path.exists():
+            self.is_downloaded = False
+
     def __str__(self) -> str:
         return f"{self.inputfile.purename}: Downloaded: {self.is_downloaded}, Converted: {self.is_converted}, Uploaded: {self.is_uploaded}"
 
@@ -82,85 +184,386 @@ async def get_folder_content(folder: rclone.RcloneDirectory) -> List[rclone.Rclo
     return content
 
 
-async def check_already_converted(file: rclone.RcloneFile, contents: List[rclone.RcloneItem]) -> bool:
+def folder_names(contents: Iterable[rclone.RcloneItem]) -> AbstractSet[str]:
+    """The names in a folder, to check many files of it against with check_to_convert."""
+    return {item.name for item in contents}
+
+
+async def check_already_converted(file: rclone.RcloneFile, names: AbstractSet[str]) -> bool:
     """Checks whether the given file is already converted in the given contents
     :param file The file to check
-    :param contents A list of contents.
+    :param names The names of everything in the folder of the file, see folder_names.
     :returns True or false"""
-    filename = file.purename
-    for item in contents:
-        if filename + '.mp4' == item.name:
-            return True
-    return False
+    return file.purename + '.mp4' in names
 
 
-async def check_to_convert(file: rclone.RcloneFile, contents: List[rclone.RcloneItem]) -> bool:
+async def check_to_convert(file: rclone.RcloneFile, names: AbstractSet[str]) -> bool:
     """Checks if the given file needs to be converted."""
     filetype = str(file.filetype)  # Finally
     if filetype.startswith('video'):
-        if (type != 'video/mp4') and (file.extension not in [".mp4", ".m4v"]):
-            already_there = await check_already_converted(file, contents)
+        if (filetype != 'video/mp4') and (file.extension not in [".mp4", ".m4v"]):
+            already_there = await check_already_converted(file, names)
             if not already_there:
                 return True
     return False
 
 
-async def worker(queue: asyncio.Queue) -> NoReturn:
-    global running_job
-    log = logger
-    while True:
-        job = await queue.get()
-        running_job = job
-        await job.run()
-        log.info(f"{queue.qsize()} items left to do")
-        queue.task_done()
+class StageStats:
+    """Counts how many jobs a pipeline stage handled and how long its workers were busy with them."""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.done = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def add(self, duration: float, size: int, ok: bool) -> None:
+        self.busy += duration
+        if ok:
+            self.done += 1
+            self.bytes += size
+        else:
+            self.failed += 1
+
+    def as_dict(self) -> Dict[str, float]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {'workers': self.workers, 'done': self.done, 'failed': self.failed, 'busy': self.busy,
+                'files_per_hour': self.done / elapsed * 3600, 'bytes_per_second': self.bytes / elapsed,
+                'utilization': self.busy / (elapsed * max(self.workers, 1))}
+
+    def __str__(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        utilization = self.busy / (elapsed * max(self.workers, 1)) * 100
+        return (f"{self.name}: {self.done} done, {self.failed} failed, {self.done / elapsed * 3600:.1f} files/h, "
+                f"{self.bytes / elapsed / 1024 / 1024:.2f} MB/s, workers {utilization:.0f}% busy")
+
+
+class EventBus:
+    """Passes job events on to every subscribed status client.
+    Each subscriber has a bounded queue, one that can't keep up gets dropped instead of slowing the pipeline down."""
+
+    def __init__(self, backlog: int = 10000):
+        self.backlog = backlog
+        self.subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.backlog)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self.subscribers.discard(queue)
+
+    def publish(self, event: str, job: 'Job', **details: Any) -> None:
+        if not self.subscribers:
+            return
+        message = {'event': event, 'path': str(job.inputfile.fullpath), **details}
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait({'event': 'overflow'})
+
+
+class Pipeline:
+    """Runs jobs through separate download, convert and upload stages, each with its own pool of workers,
+    so the network transfers of some jobs overlap with the encoding of others.
+    The queues between the stages are bounded: once enough downloaded jobs wait for an encoder,
+    the download workers wait too, so we never download much further ahead than we can encode."""
+
+    def __init__(self, downloads: int = 2, converts: Optional[int] = None, uploads: int = 2,
+                 policy: Optional[SchedulingPolicy] = None):
+        if converts is None:
+            converts = max((os.cpu_count() or 1) // video_convert.encoder_threads, 1)
+        # The cores each convert worker gets, so segmented encodes running side by side don't overload the host.
+        self.encode_cores = max((os.cpu_count() or 1) // converts, 1)
+        self.workers = {'download': downloads, 'convert': converts, 'upload': uploads}
+        self.queue = JobQueue(policy)
+        self.to_convert: asyncio.Queue = asyncio.Queue(maxsize=converts)
+        self.to_upload: asyncio.Queue = asyncio.Queue(maxsize=uploads)
+        self.running: Set[Job] = set()
+        self.events = EventBus()
+        self.encodes: Deque[video_convert.EncodeStats] = deque(maxlen=1000)
+        self.stats: Dict[str, StageStats] = {name: StageStats(name, amount) for name, amount in self.workers.items()}
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        stages = [('download', self.queue, Job.download, self.to_convert),
+                  ('convert', self.to_convert, self._convert, self.to_upload),
+                  ('upload', self.to_upload, Job.upload, None)]
+        for name, source, action, target in stages:
+            for _ in range(self.workers[name]):
+                self._tasks.append(asyncio.create_task(self._work(name, source, action, target)))
+
+    async def _convert(self, job: 'Job') -> None:
+        """Runs the encode, telling subscribers about every whole percent it progresses."""
+        reported = -1
+
+        def publish(event: video_convert.Progress) -> None:
+            nonlocal reported
+            if int(event.percent) != reported:
+                reported = int(event.percent)
+                self.events.publish('progress', job, progress=event._asdict())
+
+        await job.convert(publish, self.encode_cores)
+        if job.encode is not None:
+            self.encodes.append(job.encode)
+
+    def encode_stats(self) -> Dict[str, Dict[str, float]]:
+        """The encode speed of the recent conversions, for every preset, to spot slow presets or busy hosts."""
+        summary: Dict[str, Dict[str, float]] = {}
+        for preset in {encode.preset for encode in self.encodes}:
+            encodes = [encode for encode in self.encodes if encode.preset == preset]
+            fps = [encode.avg_fps for encode in encodes if encode.avg_fps is not None]
+            rates = [encode.bytes_per_second for encode in encodes if encode.bytes_per_second is not None]
+            summary[preset] = {'encodes': len(encodes), 'seconds': sum(encode.seconds for encode in encodes),
+                               'avg_fps': sum(fps) / len(fps) if fps else 0.0,
+                               'bytes_per_second': sum(rates) / len(rates) if rates else 0.0}
+        return summary
+
+    async def put(self, job: 'Job') -> None:
+        """Queues the job for the first stage it didn't finish yet.
+        A resumed job that skips the download counts as running, like every job between the stages does,
+        so snapshots list it."""
+        self.events.publish('queued', job, status=job.status())
+        if job.is_converted:
+            self.running.add(job)
+            await self.to_upload.put(job)
+        elif job.is_downloaded:
+            self.running.add(job)
+            await self.to_convert.put(job)
+        else:
+            await self.queue.put(job)
+
+    def pending(self, offset: int = 0, limit: Optional[int] = None) -> List['Job']:
+        """The jobs that haven't been started yet, in the order they will be."""
+        return self.queue.ordered(offset, limit)
+
+    def snapshot(self, offset: int = 0, limit: int = 100) -> Dict[str, Any]:
+        """One page of all jobs, the running ones first and then the waiting ones."""
+        running = sorted(self.running, key=lambda job: str(job.inputfile.fullpath))
+        jobs = running[offset:offset + limit]
+        jobs += self.pending(max(offset - len(running), 0), limit - len(jobs))
+        return {'total': len(running) + self.queue.qsize(), 'running': len(running), 'offset': offset,
+                'jobs': [job.status() for job in jobs]}
+
+    async def _work(self, name: str, source: asyncio.Queue, action: Callable[['Job'], Awaitable[None]],
+                    target: Optional[asyncio.Queue]) -> NoReturn:
+        log = logger
+        while True:
+            job = await source.get()
+            try:
+                self.running.add(job)
+                self.events.publish('started', job, stage=name)
+                started = time.monotonic()
+                try:
+                    await action(job)
+                    ok = True
+                except asyncio.CancelledError:  # Not an Exception subclass only from Python 3.8 on.
+                    raise
+                except Exception:
+                    log.exception(f"The {name} of {job.inputfile.name} failed")
+                    ok = False
+                size = job.inputfile._size if name == 'download' else await self._output_size(job)
+                self.stats[name].add(time.monotonic() - started, size, ok)
+                job.failed = not ok
+                job.save()
+                self.events.publish('finished' if ok else 'failed', job, stage=name)
+                if ok and target is not None:
+                    await target.put(job)  # Waits while the next stage is full.
+                else:
+                    await job.cleanup()
+                    self.running.discard(job)
+                    log.info(f"{self.queue.qsize()} items left to do. " + "; ".join(map(str, self.stats.values())))
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # Keeps this worker alive, whatever went wrong around the stage itself.
+                log.exception(f"Handling {job.inputfile.name} after its {name} failed")
+                job.failed = True
+                self.running.discard(job)
+            finally:
+                source.task_done()
+
+    async def _output_size(self, job: 'Job') -> int:
+        try:
+            return (await asyncos.stat(job.newfilepath)).st_size
+        except FileNotFoundError:
+            return 0
+
+    async def join(self) -> None:
+        """Waits until every queued job went through all stages."""
+        await self.queue.join()
+        await self.to_convert.join()
+        await self.to_upload.join()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
 
 
 async def create_server(ip: str = '0.0.0.0', port: int = 8890) -> None:
-    server = await asyncio.start_server(send_jobs, ip, port, start_serving=False)  # type: ignore
+    server = await asyncio.start_server(serve_status, ip, port, start_serving=False)  # type: ignore
     print("Now accepting connections!")
     async with server:  # type: ignore
         await server.serve_forever()  # type: ignore
 
 
-async def send_jobs(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
-    global queue
+async def serve_status(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Answers status requests, one JSON object per line in both directions:
+    {"op": "snapshot", "offset": 0, "limit": 100} -> one page of the jobs, see Pipeline.snapshot.
+    {"op": "stats"} -> the throughput of every stage, and the encode speed per preset under "encodes".
+    {"op": "profile"} -> {"enabled": bool, "commands": the subprocess profile, see asyncrun.profiler}.
+    {"op": "subscribe"} -> {"subscribed": true}, followed by every job event (queued, started, finished, failed,
+    progress) until the client disconnects. A client that falls too far behind gets {"event": "overflow"}
+    and is dropped, it has to take a new snapshot then."""
     addr = writer.get_extra_info('peername')
     print(f"Got connection from {addr}")
-    sendqueue = deque(queue._queue)  # type: ignore
-    sendqueue.appendleft(running_job)
-    pickledqueue = pickletools.optimize(pickle.dumps(sendqueue, protocol=4))
-    writer.write(pickledqueue)
-    await writer.drain()
-    writer.close()
 
+    async def send(message: Dict[str, Any]) -> None:
+        writer.write(json.dumps(message).encode() + b'\n')
+        await writer.drain()
+
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                op = request['op']
+            except (ValueError, KeyError, TypeError) as error:
+                await send({'error': f"Bad request: {error!r}"})
+                continue
+            if op == 'snapshot':
+                await send(pipeline.snapshot(int(request.get('offset', 0)), min(int(request.get('limit', 100)), 1000)))
+            elif op == 'stats':
+                stats = {name: stats.as_dict() for name, stats in pipeline.stats.items()}
+                await send({**stats, 'encodes': pipeline.encode_stats()})
+            elif op == 'profile':
+                await send({'enabled': asyncrun.profiler.enabled, 'commands': asyncrun.profiler.as_dict()})
+            elif op == 'subscribe':
+                events = pipeline.events.subscribe()
+                try:
+                    await send({'subscribed': True})
+                    while True:
+                        event = await events.get()
+                        await send(event)
+                        if event['event'] == 'overflow':
+                            break
+                finally:
+                    pipeline.events.unsubscribe(events)
+                break
+            else:
+                await send({'error': f"Unknown op {op}"})
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
 
-async def main(drive: str, path: Union[str, PurePosixPath] = basepath) -> None:
-    loop = asyncio.get_event_loop()
-    global queue
+
+async def main(drive: str, path: Union[str, PurePosixPath] = basepath, downloads: int = 2,
+               converts: Optional[int] = None, uploads: int = 2, local: bool = True,
+               coordinator_port: Optional[int] = 8892, resume: bool = True, listings: int = 4,
+               stream: bool = False, temp_budget: Optional[int] = None, policy: str = 'fifo',
+               priorities: Optional[Dict[str, int]] = None, segmented_from: Optional[int] = None,
+               calibrate: Optional[float] = None, retry_failed: bool = True, coordinator_ip: str = '127.0.0.1',
+               token: Optional[str] = None) -> None:
+    """Converts all videos below the path that aren't converted yet.
+    The remote gets crawled folder by folder, and the jobs of a folder are queued as soon as it is listed,
+    so converting starts while the rest is still being scanned.
+    :param listings How many folders get listed at once.
+    :param stream Whether inputs may be read from the remote through a read-only rclone mount
+    instead of downloading them, which happens once the downloads would exceed temp_budget.
+    :param temp_budget How many bytes of downloaded inputs the temp folder may hold, unlimited if None.
+    :param policy The order jobs get started in, one of cloudconvert_queue.policies:
+    fifo, sjf (smallest files first), fair (taking turns between folders) or priority.
+    :param priorities Priorities for the jobs below remote paths like "Drive:/Videos/Series", the longest match wins.
+    :param segmented_from Inputs bigger than this many bytes get cut into pieces that are encoded at the same time,
+    see video_convert.convert_segmented.
+    :param calibrate Picks the encoder settings for every kind of input with a few sample encodes, the slowest
+    settings that still encode at least this many times as fast as the video plays, see video_convert.calibrate.
+    :param local Whether this machine converts too, or only hands the jobs out to remote workers.
+    :param coordinator_port Where remote workers (cloudconvert_worker) can get jobs, None to not accept any.
+    :param coordinator_ip The address the coordinator listens on, only this machine by default.
+    Use 0.0.0.0 for remote workers, together with a token they have to send.
+    :param resume Whether jobs get stored in the database. Unfinished ones from an earlier run are picked up
+    again right away, where they left off if their files are still in the temp folder,
+    and the scan of the remote only creates jobs for files the database doesn't know yet.
+    :param retry_failed Whether resumed jobs include the ones that failed in an earlier run, so errors like a
+    dropped connection don't skip a file for good. Without it they stay failed until their record is deleted."""
+    global pipeline, persist, budget, streamer, segment_size, calibrate_speed
+    segment_size = segmented_from
+    calibrate_speed = calibrate
 
     async def search(folder: rclone.RcloneDirectory):
-        global queue
-        contents = await folder.get_contents()
-        for item in contents:
-            if isinstance(item, rclone.RcloneDirectory):
-                await search(item)
-            elif isinstance(item, rclone.RcloneFile):
-                to_convert = await check_to_convert(item, contents)
+        names = folder_names(folder._contents)
+        for item in folder._contents:
+            if isinstance(item, rclone.RcloneFile):
+                if str(item.fullpath) in known:
+                    continue
+                to_convert = await check_to_convert(item, names)
                 if to_convert:
                     job = Job(inputfile=item)
-                    await queue.put(job)
+                    job.priority = priority_of(job)
+                    job.save()
+                    await pipeline.put(job)
+                    found.append(job)
+
+    def priority_of(job: Job) -> int:
+        path = str(job.inputfile.fullpath)
+        matches = [prefix for prefix in priorities or {} if path == prefix or path.startswith(prefix.rstrip('/') + '/')]
+        return priorities[max(matches, key=len)] if matches else 0
 
-    queue = asyncio.Queue(loop=loop)
+    pipeline = Pipeline(downloads, converts, uploads, policies[policy]())
     log = logger
-    root = await rclone.tree(drive, path)
-    task = asyncio.create_task(worker(queue))
+    known: Set[str] = set()
+    found: List[Job] = []
+    if temp_budget is not None or stream:
+        budget = TempBudget(temp_budget or 0)
+    if stream:
+        streamer = StreamMount()
+    if local:
+        pipeline.start()
+    coordinator = None
+    if coordinator_port is not None:
+        coordinator = Coordinator(pipeline, token=token)
+        await coordinator.start(coordinator_ip, coordinator_port)
     server = asyncio.create_task(create_server())
-    await search(root)
-    log.info(f"Found {queue.qsize()} items to convert")
-    await queue.join()
-    task.cancel()
+    if resume:
+        database.getdb()
+        persist = True
+        known = {record.fullpath for record in database.JobRecord.select(database.JobRecord.fullpath)}
+        unfinished = database.JobRecord.select().where(~database.JobRecord.uploaded)
+        if not retry_failed:
+            unfinished = unfinished.where(~database.JobRecord.failed)
+        for record in unfinished:
+            job = Job.from_record(record)
+            job.failed = False
+            job.priority = priority_of(job)
+            if local:
+                job.check_files()
+            else:
+                job.is_downloaded = job.is_converted = False
+            await pipeline.put(job)
+        log.info(f"Resumed {len(unfinished)} unfinished jobs")
+    await rclone.crawl(rclone.directory_at(drive, path), listings, on_directory=search)
+    log.info(f"Found {len(found)} new items to convert")
+    await pipeline.join()
+    await pipeline.stop()
+    if coordinator is not None:
+        await coordinator.stop()
+    if streamer is not None:
+        await streamer.close()
     server.cancel()
+    for stats in pipeline.stats.values():
+        log.info(str(stats))
     log.info("Done with all the conversions!")
 
 
@@ -1,26 +1,72 @@
 import asyncio
-import pickle
+import json
 import PySimpleGUIQt as sg  # type: ignore
-from cloudconvert import Job as Job
-from typing import Deque, Union, List
+from typing import Any, AsyncIterator, Dict, List, Union
 import pprint
 
 host = "185.223.29.82"
 
 
-async def get_queue(ip: str = host, port: Union[int, str] = 8890) -> Deque[Job]:
+async def request(ip: str, port: Union[int, str], message: Dict[str, Any]) -> Dict[str, Any]:
     reader, writer = await asyncio.open_connection(ip, port)
-    data = await reader.read()
-    queue = pickle.loads(data)
-    return queue
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+    reply = json.loads(await reader.readline())
+    writer.close()
+    return reply
+
+
+async def get_snapshot(ip: str = host, port: Union[int, str] = 8890, offset: int = 0,
+                       limit: int = 100) -> Dict[str, Any]:
+    """Fetches one page of the jobs of the server, the running ones come first.
+    :returns A dict with the total amount of jobs, how many of them are running, and the jobs of the page."""
+    return await request(ip, port, {'op': 'snapshot', 'offset': offset, 'limit': limit})
+
+
+async def get_queue(ip: str = host, port: Union[int, str] = 8890, page_size: int = 500) -> List[Dict[str, Any]]:
+    """Fetches all jobs of the server, page by page."""
+    jobs: List[Dict[str, Any]] = []
+    while True:
+        page = await get_snapshot(ip, port, len(jobs), page_size)
+        jobs.extend(page['jobs'])
+        if not page['jobs'] or len(jobs) >= page['total']:
+            return jobs
+
+
+async def subscribe(ip: str = host, port: Union[int, str] = 8890) -> AsyncIterator[Dict[str, Any]]:
+    """Yields the job events of the server as they happen.
+    Ends after an overflow event, when this client fell too far behind."""
+    reader, writer = await asyncio.open_connection(ip, port)
+    try:
+        writer.write(b'{"op": "subscribe"}\n')
+        await writer.drain()
+        await reader.readline()
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            yield json.loads(line)
+    finally:
+        writer.close()
+
+
+async def get_profile(ip: str = host, port: Union[int, str] = 8890) -> Dict[str, Any]:
+    """Fetches the subprocess profile of the server, it is only filled when profiling is enabled there.
+    :returns Whether profiling is enabled, and the stats of every command under "commands"."""
+    return await request(ip, port, {'op': 'profile'})
+
+
+def describe(job: Dict[str, Any]) -> str:
+    return (f"{job['path']}: Downloaded: {job['downloaded']}, Converted: {job['converted']}, "
+            f"Uploaded: {job['uploaded']}")
 
 
 async def main() -> None:
-    queue = await get_queue(host)  # type: Deque[Job]
-    output = ["Currently Running Job:", str(queue.popleft()), "Other Jobs:"]  # type: List[Union[str, Job]]
-    output.extend(queue)
-    for job in queue:
-        print(str(job))
+    snapshot = await get_snapshot(host)
+    output = [f"{snapshot['running']} running, {snapshot['total']} jobs in total:"]
+    output.extend(map(describe, snapshot['jobs']))
+    for line in output:
+        print(line)
     layout = [[sg.Text("Here are the jobs:")],
               [sg.Listbox(output)],
               [sg.CloseButton("Close")]]
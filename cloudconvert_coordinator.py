@@ -0,0 +1,216 @@
+import asyncio
+import hmac
+import itertools
+import json
+import time
+import video_convert
+from loguru import logger
+from typing import TYPE_CHECKING, Any, Dict, Optional, Set
+
+if TYPE_CHECKING:
+    from cloudconvert import Job, Pipeline
+
+log = logger
+
+
+def read_progress(fields: Any) -> Optional[video_convert.Progress]:
+    """The Progress a worker sent, keeping only the fields this version knows.
+    None if there is none, or if fields it needs are missing."""
+    if not isinstance(fields, dict):
+        return None
+    try:
+        return video_convert.Progress(**{key: value for key, value in fields.items()
+                                         if key in video_convert.Progress._fields})
+    except TypeError:
+        return None
+
+
+class Lease:
+    """A job handed out to a remote worker, which has to renew it with heartbeats before it expires."""
+
+    def __init__(self, id: str, job: 'Job', worker: str, owner: Any, lease_time: float):
+        self.id = id
+        self.job = job
+        self.worker = worker
+        self.owner = owner  # The connection the lease was handed out on.
+        self.lease_time = lease_time
+        self.expires = time.monotonic() + lease_time
+
+    def renew(self) -> None:
+        self.expires = time.monotonic() + self.lease_time
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() > self.expires
+
+
+class Coordinator:
+    """Hands the waiting jobs of a Pipeline out to remote workers, see cloudconvert_worker.
+    Workers talk JSON lines over one TCP connection, every request gets exactly one reply:
+    {"op": "lease", "worker": name} -> {"lease": id, "lease_time": seconds, "job": Job.to_dict()},
+    or {"job": null, "retry_in": seconds} while nothing is waiting.
+    {"op": "heartbeat", "lease": id, "state": {"downloaded": ..., "progress": video_convert.Progress}}
+    -> {"ok": false} once the lease is gone.
+    {"op": "result", "lease": id, "ok": true/false, "error": message} -> {"ok": whether the result was accepted}.
+    Leases that aren't renewed in time, or whose worker disconnects, go back into the queue,
+    a job that failed or expired max_attempts times gets dropped.
+    With a token, every request has to carry it as "token", a connection that sends a wrong one gets closed.
+    Jobs are taken from the same queue as the local stages, so Pipeline.join also waits for the remote ones."""
+
+    def __init__(self, pipeline: 'Pipeline', lease_time: float = 60.0, max_attempts: int = 3, retry_in: float = 5.0,
+                 token: Optional[str] = None):
+        self.pipeline = pipeline
+        self.token = token
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self.retry_in = retry_in
+        self.leases: Dict[str, Lease] = {}
+        self.attempts: Dict['Job', int] = {}
+        self.finished = 0
+        self.failed = 0
+        self._ids = itertools.count(1)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def start(self, ip: str = '127.0.0.1', port: int = 8892) -> None:
+        """Starts accepting workers, only local ones by default. Set a token before listening on other addresses.
+        :param port 0 picks a free port, see the port property."""
+        self._server = await asyncio.start_server(self._handle, ip, port)
+        self._reaper = asyncio.create_task(self._reap())
+        log.info(f"Handing out jobs to workers on {ip}:{self.port}")
+
+    @property
+    def port(self) -> Optional[int]:
+        if self._server is None or not self._server.sockets:
+            return None
+        return self._server.sockets[0].getsockname()[1]
+
+    def authorized(self, message: Any) -> bool:
+        if self.token is None:
+            return True
+        return isinstance(message, dict) and hmac.compare_digest(str(message.get('token', '')), self.token)
+
+    async def stop(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+        if self._server is not None:
+            self._server.close()
+            for writer in self._connections:  # Lets the workers know there won't be any more jobs.
+                writer.close()
+            await self._server.wait_closed()
+        log.info(f"Remote workers finished {self.finished} jobs, {self.failed} were given up on")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        addr = writer.get_extra_info('peername')
+        log.info(f"Worker connected from {addr}")
+        self._connections.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    if not self.authorized(message):
+                        log.warning(f"Worker from {addr} sent a wrong token, closing the connection")
+                        writer.write(json.dumps({'error': "Wrong token"}).encode() + b'\n')
+                        break
+                    reply = self._dispatch(message, writer)
+                except (ValueError, KeyError, TypeError) as error:
+                    reply = {'error': f"Bad request: {error!r}"}
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(writer)
+            for lease in [lease for lease in self.leases.values() if lease.owner is writer]:
+                self._retry(lease, f"its worker {lease.worker} disconnected")
+            writer.close()
+            log.info(f"Worker from {addr} disconnected")
+
+    def _dispatch(self, message: Dict[str, Any], owner: Any) -> Dict[str, Any]:
+        op = message['op']
+        if op == 'lease':
+            return self.lease(str(message.get('worker', '?')), owner)
+        if op == 'heartbeat':
+            return {'ok': self.heartbeat(message['lease'], message.get('state'))}
+        if op == 'result':
+            return {'ok': self.result(message['lease'], bool(message['ok']), message.get('error'))}
+        raise KeyError(op)
+
+    def lease(self, worker: str, owner: Any = None) -> Dict[str, Any]:
+        try:
+            job = self.pipeline.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return {'job': None, 'retry_in': self.retry_in}
+        # Whatever an earlier attempt did happened on another machine, so the worker starts over.
+        job.is_downloaded = job.is_converted = job.is_uploaded = False
+        lease = Lease(str(next(self._ids)), job, worker, owner, self.lease_time)
+        self.leases[lease.id] = lease
+        self.pipeline.running.add(job)
+        self.pipeline.events.publish('started', job, stage='remote', worker=worker)
+        log.info(f"Leased {job.inputfile.name} to {worker}")
+        return {'lease': lease.id, 'lease_time': self.lease_time, 'job': job.to_dict()}
+
+    def heartbeat(self, lease_id: str, state: Optional[Dict[str, Any]] = None) -> bool:
+        lease = self.leases.get(lease_id)
+        if lease is None:
+            return False
+        lease.renew()
+        if state:
+            lease.job.is_downloaded = state.get('downloaded', lease.job.is_downloaded)
+            lease.job.is_converted = state.get('converted', lease.job.is_converted)
+            lease.job.is_uploaded = state.get('uploaded', lease.job.is_uploaded)
+            progress = read_progress(state.get('progress'))
+            if progress is not None:
+                lease.job.progress = progress
+                self.pipeline.events.publish('progress', lease.job, progress=progress._asdict(), worker=lease.worker)
+        return True
+
+    def result(self, lease_id: str, ok: bool, error: Optional[str] = None) -> bool:
+        """Records how a leased job went. Results for leases that already expired are rejected,
+        because their job is back in the queue or running somewhere else by now."""
+        lease = self.leases.get(lease_id)
+        if lease is None:
+            return False
+        if ok:
+            del self.leases[lease_id]
+            self.pipeline.running.discard(lease.job)
+            self.attempts.pop(lease.job, None)
+            self.finished += 1
+            lease.job.is_downloaded = lease.job.is_converted = lease.job.is_uploaded = True
+            lease.job.save()
+            log.info(f"{lease.worker} finished {lease.job.inputfile.name}")
+            self.pipeline.events.publish('finished', lease.job, stage='remote', worker=lease.worker)
+            self.pipeline.queue.task_done()
+        else:
+            self._retry(lease, f"{lease.worker} failed it: {error}")
+        return True
+
+    def _retry(self, lease: Lease, reason: str) -> None:
+        """Puts the job of the lease back into the queue, unless it ran out of attempts."""
+        del self.leases[lease.id]
+        job = lease.job
+        self.pipeline.running.discard(job)
+        attempts = self.attempts.get(job, 0) + 1
+        self.pipeline.events.publish('failed', job, stage='remote', worker=lease.worker, reason=reason)
+        if attempts < self.max_attempts:
+            self.attempts[job] = attempts
+            log.warning(f"Requeueing {job.inputfile.name} because {reason}")
+            self.pipeline.queue.put_nowait(job)
+            self.pipeline.events.publish('queued', job, status=job.status())
+        else:
+            self.attempts.pop(job, None)
+            self.failed += 1
+            job.failed = True
+            job.save()
+            log.error(f"Giving up on {job.inputfile.name} after {attempts} attempts, {reason}")
+        self.pipeline.queue.task_done()  # For the get that handed it out.
+
+    async def _reap(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.lease_time / 4, 5.0))
+            for lease in [lease for lease in self.leases.values() if lease.expired]:
+                self._retry(lease, f"the lease of {lease.worker} expired")
@@ -0,0 +1,72 @@
+import asyncio
+import heapq
+import itertools
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Type
+
+if TYPE_CHECKING:
+    from cloudconvert import Job
+
+
+class SchedulingPolicy:
+    """Decides in which order queued jobs get started, jobs with smaller keys first.
+    Jobs with equal keys are started in the order they were queued, so this base policy is first in, first out."""
+
+    def key(self, job: 'Job') -> Tuple:
+        return ()
+
+
+class ShortestFirst(SchedulingPolicy):
+    """Starts the smallest files first, so a few huge ones don't hold up everything else."""
+
+    def key(self, job: 'Job') -> Tuple:
+        return (job.inputfile._size or 0,)
+
+
+class FairFolders(SchedulingPolicy):
+    """Takes turns between folders: the first job of every folder, then the second of every folder and so on."""
+
+    def __init__(self):
+        self.queued: Dict[Optional[str], int] = {}
+
+    def key(self, job: 'Job') -> Tuple:
+        folder = job.inputfile._parent
+        turn = self.queued.get(folder, 0)
+        self.queued[folder] = turn + 1
+        return (turn,)
+
+
+class Priorities(SchedulingPolicy):
+    """Starts jobs with a higher Job.priority first."""
+
+    def key(self, job: 'Job') -> Tuple:
+        return (-job.priority,)
+
+
+policies: Dict[str, Type[SchedulingPolicy]] = {'fifo': SchedulingPolicy, 'sjf': ShortestFirst, 'fair': FairFolders,
+                                               'priority': Priorities}
+
+
+class JobQueue(asyncio.Queue):
+    """An asyncio.Queue of jobs that hands them out in the order of a scheduling policy."""
+
+    def __init__(self, policy: Optional[SchedulingPolicy] = None, maxsize: int = 0):
+        self.policy = policy or SchedulingPolicy()
+        super().__init__(maxsize)
+
+    def _init(self, maxsize: int) -> None:
+        self._queue: List[Tuple[Tuple, int, Any]] = []
+        self._sequence = itertools.count()
+
+    def _put(self, job: 'Job') -> None:
+        heapq.heappush(self._queue, (self.policy.key(job), next(self._sequence), job))
+
+    def _get(self) -> 'Job':
+        return heapq.heappop(self._queue)[2]
+
+    def ordered(self, offset: int = 0, limit: Optional[int] = None) -> List['Job']:
+        """The queued jobs from offset on, in the order they will be started."""
+        if limit is None:
+            entries = sorted(self._queue)
+        else:
+            entries = heapq.nsmallest(offset + limit, self._queue)
+        return [entry[2] for entry in entries[offset:]]
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import tempfile
+from loguru import logger
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import rclone
+
+log = logger
+
+
+class TempBudget:
+    """Keeps track of how many bytes of downloaded inputs the temp folder holds, so downloads stay within limit.
+    A file bigger than the whole budget may still be downloaded while nothing else is."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._changed = asyncio.Condition()
+
+    def _fits(self, size: int) -> bool:
+        return self.used + size <= self.limit
+
+    def try_reserve(self, size: int) -> bool:
+        """Reserves the space if it is free right now.
+        :returns Whether it was."""
+        if not self._fits(size):
+            return False
+        self.used += size
+        return True
+
+    async def reserve(self, size: int) -> None:
+        """Waits until the space is free and reserves it."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._fits(size) or self.used == 0)
+            self.used += size
+
+    async def release(self, size: int) -> None:
+        async with self._changed:
+            self.used -= size
+            self._changed.notify_all()
+
+
+class StreamMount:
+    """Mounts remotes read only with rclone mount, so the encoder can read and seek in a remote file
+    like in a local one without downloading it first. HandBrake only reads local files reliably,
+    its demuxers for formats like MPEG-TS don't go through the network protocols, so a mount works where
+    an HTTP URL wouldn't. One mount gets made per drive, on first use, and needs FUSE (macFUSE on macOS)."""
+
+    def __init__(self, flags: Optional[List[str]] = None):
+        self.flags = flags or []
+        self._mounts: Dict[str, Tuple[asyncio.subprocess.Process, Path]] = {}
+        self._lock = asyncio.Lock()
+
+    async def path(self, file: rclone.RcloneFile) -> Path:
+        """The local path the file can be read from."""
+        if not file.drive:  # A local file can be read where it is.
+            return Path(file._path)
+        mountpoint = await self._mount(file.drive)
+        return Path(mountpoint, file._path.lstrip('/'))
+
+    async def _mount(self, drive: str, timeout: float = 30.0) -> Path:
+        async with self._lock:
+            if drive in self._mounts:
+                return self._mounts[drive][1]
+            remote = drive if drive.endswith(':') else drive + ':'
+            mountpoint = Path(tempfile.mkdtemp(prefix='cloudconvert-'))
+            log.info(f"Mounting {remote} on {mountpoint}")
+            proc = await asyncio.subprocess.create_subprocess_exec(
+                'rclone', 'mount', remote, str(mountpoint), '--read-only', *self.flags,
+                stdout=asyncio.subprocess.DEVNULL)
+            waited = 0.0
+            while not os.path.ismount(mountpoint):
+                if proc.returncode is not None or waited >= timeout:
+                    if proc.returncode is None:
+                        proc.terminate()
+                        await proc.wait()
+                    mountpoint.rmdir()
+                    raise RuntimeError(f"rclone mount for {remote} didn't come up on {mountpoint}")
+                await asyncio.sleep(0.1)
+                waited += 0.1
+            self._mounts[drive] = (proc, mountpoint)
+            return mountpoint
+
+    async def close(self) -> None:
+        """Unmounts everything, rclone does that when it gets terminated."""
+        for proc, mountpoint in self._mounts.values():
+            if proc.returncode is None:
+                proc.terminate()
+                await proc.wait()
+            try:
+                mountpoint.rmdir()
+            except OSError:  # Still busy, leave it to the system.
+                log.warning(f"Couldn't remove the mountpoint {mountpoint}")
+        self._mounts.clear()
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+from loguru import logger
+from pathlib import *
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from cloudconvert import Job
+
+log = logger
+Request = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class ProtocolError(Exception):
+    """The coordinator answered a request with an error, the connection itself is still fine."""
+
+
+async def process(job: Job) -> None:
+    try:
+        await job.download()
+        await job.convert()
+        await job.upload()
+    finally:
+        await job.cleanup()
+
+
+async def run_leased(job: Job, lease: str, lease_time: float, request: Request) -> Tuple[bool, Optional[str]]:
+    """Runs the job while renewing its lease, and stops working on it as soon as the lease is lost.
+    :returns Whether the job succeeded, and the error if it didn't."""
+    task = asyncio.create_task(process(job))
+    while not task.done():
+        await asyncio.wait({task}, timeout=lease_time / 3)
+        if task.done():
+            break
+        state = {'downloaded': job.is_downloaded, 'converted': job.is_converted, 'uploaded': job.is_uploaded}
+        if job.progress is not None:
+            state['progress'] = job.progress._asdict()
+        try:
+            reply = await request({'op': 'heartbeat', 'lease': lease, 'state': state})
+        except ProtocolError as error:  # Keep working, the lease runs out if the coordinator never takes one.
+            log.warning(f"Heartbeat for {job.inputfile.name} rejected: {error}")
+            continue
+        if not reply.get('ok'):
+            log.warning(f"Lost the lease on {job.inputfile.name}, stopping")
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return False, "lease lost"
+    if task.exception() is not None:
+        log.opt(exception=task.exception()).error(f"{job.inputfile.name} failed")
+        return False, repr(task.exception())
+    return True, None
+
+
+async def main(host: str = 'localhost', port: Union[int, str] = 8892, temppath: Optional[Path] = None,
+               name: Optional[str] = None, token: Optional[str] = None) -> None:
+    """Works on jobs from a cloudconvert coordinator until it goes away.
+    The rclone remotes the coordinator works with have to be configured on this machine as well.
+    :param temppath Where files get downloaded and converted, separate for every worker by default,
+    so several workers can run on one machine.
+    :param token The coordinator's token, taken from the environment variable CLOUDCONVERT_TOKEN by default."""
+    if token is None:
+        token = os.environ.get('CLOUDCONVERT_TOKEN')
+    if name is None:
+        name = f"{socket.gethostname()}-{os.getpid()}"
+    if temppath is None:
+        temppath = Path(Path.cwd(), 'tmp', name)
+    temppath.mkdir(parents=True, exist_ok=True)
+    reader, writer = await asyncio.open_connection(host, int(port))
+    lock = asyncio.Lock()  # Replies come in the order of the requests, so only one may be underway.
+
+    async def request(message: Dict[str, Any]) -> Dict[str, Any]:
+        if token is not None:
+            message = {**message, 'token': token}
+        async with lock:
+            writer.write(json.dumps(message).encode() + b'\n')
+            await writer.drain()
+            line = await reader.readline()
+        if not line:
+            raise ConnectionError("The coordinator closed the connection")
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ProtocolError(reply['error'])
+        return reply
+
+    log.info(f"Worker {name} connected to {host}:{port}")
+    try:
+        while True:
+            try:
+                reply = await request({'op': 'lease', 'worker': name})
+            except ProtocolError as error:
+                log.warning(f"The coordinator refused to hand out a job: {error}")
+                await asyncio.sleep(1)
+                continue
+            if reply.get('job') is None:
+                await asyncio.sleep(reply.get('retry_in', 5))
+                continue
+            job = Job.from_dict(reply['job'], temppath)
+            ok, error = await run_leased(job, reply['lease'], reply['lease_time'], request)
+            try:
+                await request({'op': 'result', 'lease': reply['lease'], 'ok': ok, 'error': error})
+            except ProtocolError as refused:
+                log.warning(f"The coordinator refused the result for {job.inputfile.name}: {refused}")
+    except ConnectionError as error:
+        log.info(f"Stopping: {error}")
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        print("Usage: cloudconvert_worker.py host [port] [tmpdir]")
+        sys.exit(1)
+    arguments = sys.argv[1:]
+    asyncio.run(main(arguments[0], *arguments[1:2], *(Path(arg) for arg in arguments[2:3])))
@@ -1,7 +1,36 @@
+from peewee import BigIntegerField, BooleanField, FloatField, Model, TextField
+from playhouse.shortcuts import model_to_dict
 from playhouse.sqliteq import SqliteQueueDatabase
 
-db = SqliteQueueDatabase("db.sqlite")
+db = SqliteQueueDatabase("db.sqlite", autostart=False)  # Started by getdb, so importing this creates no file.
+
+
+class BaseModel(Model):
+    class Meta:
+        database = db
+
+
+class JobRecord(BaseModel):
+    """A conversion job of cloudconvert, with the metadata of the file it was created from and how far it got.
+    The fields are named like the keys of Job.to_dict."""
+    fullpath = TextField(primary_key=True)
+    drive = TextField()
+    directory = TextField()
+    name = TextField()
+    size = BigIntegerField()
+    mimetype = TextField()
+    modtime = FloatField(null=True)
+    hash = TextField(null=True)
+    downloaded = BooleanField(default=False)
+    converted = BooleanField(default=False)
+    uploaded = BooleanField(default=False)
+    failed = BooleanField(default=False)
 
 
 def getdb():
+    if db.is_stopped():
+        db.start()
+    db.create_tables([JobRecord], safe=True)
+    # Writes run in the background, so wait for a statement queued after the tables until they exist.
+    db.execute_sql("PRAGMA user_version").fetchall()
     return db
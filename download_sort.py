@@ -1,8 +1,10 @@
 import asyncio
+import os
 import sys
+import threading
 import GUI
 from pathlib import Path
-from typing import List, Union, Tuple
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Union
 
 import aiofiles.os as asyncos  # type: ignore
 
@@ -15,6 +17,9 @@ programtype = ("iso", "dmg", "app", "exe", "py", "jar", "swf", "apk")
 archivetype = ("zip", "7z", "rar", "gz", "tar", "xz", "webarchive")
 videotype = ("mp4", "m4v", "mov", "mkv", "flv")
 audiotype = ("aac", "mp3", "aax", "m4a", "m4b", "wma", "flac", "wav")
+folders = (("Dokumente", documenttype), ("Bilder", picturetype), ("Programme", programtype), ("Archive", archivetype),
+           ("Videos", videotype), ("Audios", audiotype))
+batch_size = 256  # How many found files the walker thread hands over at once.
 
 
 async def makedir(directory: Path, name: str) -> Path:
@@ -24,44 +29,76 @@ async def makedir(directory: Path, name: str) -> Path:
     return newpath
 
 
-async def all_files(path: Path) -> List[Path]:
-    files = []
-    for item in path.iterdir():
-        if not item.name.startswith('.'):
-            if item.is_file():
-                files.append(item)
-            elif item.is_dir():
-                subfiles = await all_files(item)
-                files += subfiles
-    return files
-
-
-async def splitup(files: List[Path]) -> Tuple[List[Path], List[Path], List[Path], List[Path], List[Path], List[Path]]:
-    """Splits the files based on the file extension.
-
-    :param files: A list of Paths(Files) to split up.
-    :returns A Tuple of Paths in the following order: Documents, Pictures, Programs, Archives, Videos, Audios"""
-    documents = []
-    pictures = []
-    programs = []
-    archives = []
-    videos = []
-    audios = []
-    for file in files:
-        ext = file.suffix.strip('.')
-        if ext in documenttype:
-            documents.append(file)
-        elif ext in picturetype:
-            pictures.append(file)
-        elif ext in programtype:
-            programs.append(file)
-        elif ext in archivetype:
-            archives.append(file)
-        elif ext in videotype:
-            videos.append(file)
-        elif ext in audiotype:
-            audios.append(file)
-    return documents, pictures, programs, archives, videos, audios
+def walk_files(path: Path, stop: Optional[threading.Event] = None) -> Iterator[Path]:
+    """Yields all files below path, skipping hidden files and folders, as they are found.
+    Works through the folders with a stack instead of recursion, and uses the file types scandir already knows,
+    so no extra stat is needed per entry. Symlinked folders aren't followed, so links can't cause loops.
+    :param stop Stops the walk once it is set."""
+    directories = [os.fspath(path)]
+    while directories:
+        if stop is not None and stop.is_set():
+            return
+        try:
+            entries = os.scandir(directories.pop())
+        except OSError:  # Vanished or not readable, like the original skipped them too.
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file():
+                    yield Path(entry.path)
+
+
+async def all_files(path: Path) -> AsyncIterator[Path]:
+    """Yields all files below path while a thread is still looking for more, so the event loop never blocks."""
+    loop = asyncio.get_running_loop()
+    found: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def hand_over(batch: Optional[List[Path]]) -> bool:
+        try:
+            loop.call_soon_threadsafe(found.put_nowait, batch)
+            return True
+        except RuntimeError:  # The loop is closed already, because nobody is reading anymore.
+            stop.set()
+            return False
+
+    def walk() -> None:
+        batch: List[Path] = []
+        try:
+            for file in walk_files(path, stop):
+                batch.append(file)
+                if len(batch) >= batch_size:
+                    if not hand_over(batch):
+                        return
+                    batch = []
+        finally:
+            if hand_over(batch):
+                hand_over(None)
+
+    walker = loop.run_in_executor(None, walk)
+    try:
+        while True:
+            batch = await found.get()
+            if batch is None:
+                break
+            for file in batch:
+                yield file
+        await walker  # Raises what went wrong in the thread, if anything.
+    finally:
+        stop.set()
+
+
+def folder_for(file: Path) -> Optional[str]:
+    """The name of the folder the file gets sorted into, None if it stays where it is."""
+    ext = file.suffix.strip('.')
+    for name, types in folders:
+        if ext in types:
+            return name
+    return None
 
 
 async def move_file(file: Path, dest: Path) -> None:
@@ -69,10 +106,11 @@ async def move_file(file: Path, dest: Path) -> None:
 
     :param file: The file to move.
     :param dest: The folder to move the file to."""
-    dest = dest.absolute()
-    if file.parent != dest:
+    dest = dest.resolve()
+    # Resolved, so a file sort already moved here isn't moved again when the walk comes across it.
+    if file.parent.resolve() != dest:
         destination = Path(dest, file.name)
-        if not dest.exists():
+        if not destination.exists():
             await asyncos.rename(file, destination)
         else:
             await move_existing_file(file, destination)
@@ -88,32 +126,15 @@ async def move_existing_file(file: Path, dest: Path, count: int = 1) -> None:
 
 
 async def sort(dir: Path):
-    files = await all_files(dir)
-    docs, pics, progs, archs, vids, auds = await splitup(files)
-    if docs:
-        docdir = await makedir(dir, "Dokumente")
-        for doc in docs:
-            await move_file(doc, docdir)
-    if pics:
-        picdir = await makedir(dir, "Bilder")
-        for pic in pics:
-            await move_file(pic, picdir)
-    if progs:
-        progdir = await makedir(dir, "Programme")
-        for prog in progs:
-            await move_file(prog, progdir)
-    if archs:
-        archdir = await makedir(dir, "Archive")
-        for arch in archs:
-            await move_file(arch, archdir)
-    if vids:
-        viddir = await makedir(dir, "Videos")
-        for vid in vids:
-            await move_file(vid, viddir)
-    if auds:
-        auddir = await makedir(dir, "Audios")
-        for aud in auds:
-            await move_file(aud, auddir)
+    """Moves every file below dir into the folder for its type, starting while the rest is still being found."""
+    targets: Dict[str, Path] = {}
+    async for file in all_files(dir):
+        name = folder_for(file)
+        if name is None:
+            continue
+        if name not in targets:
+            targets[name] = await makedir(dir, name)
+        await move_file(file, targets[name])
 
 
 async def cleanup(directory: Path) -> None:
@@ -1,15 +1,24 @@
 import asyncio
+import codecs
+import datetime
 import decimal
 import json
-import nest_asyncio  # type: ignore
+import subprocess
+import sys
+import tempfile
+from array import array
 from abc import ABC, abstractmethod
 from pathlib import *
-from asyncrun import asyncrun
-from typing import Union, Tuple, List, Dict, Optional, Any
+from asyncrun import asyncrun, asyncrun_stream
+from rclone_cache import CommandCache, normalize
+from rclone_rc import RcloneRC, split_remote
+from typing import Union, Tuple, List, Dict, Optional, Any, Iterable, Iterator, AsyncIterator, Awaitable, Callable, Set
 
 rclone_flags = '--fast-list'
+checksum_config = {'CheckSum': True}  # The rc equivalent of -c
 
-loop: asyncio.AbstractEventLoop
+rc: Optional[RcloneRC] = None  # Set by use_rc, otherwise every operation runs its own rclone process.
+cache = CommandCache()  # Shares and remembers lsjson, size and md5sum results, set cache.enabled to turn it off.
 
 
 def decode(input: str) -> Any:
@@ -29,20 +38,41 @@ def split(list: list) -> Tuple[list, list]:
 
 class RcloneItem(ABC):
     """Represents the concept of an object on a rclone Drive.
-    Both files and folders."""
+    Both files and folders.
+    Only the relative path and name are stored, all other paths get derived on access.
+    The drive and parent strings are interned, so items in the same folder share them."""
+    __slots__ = ('drive', 'name', '_path', '_parent', '_size', '_container')
+    is_directory: bool = False
 
     def __init__(self, item, drive: str, path):
-        self._item = item
-        self._orig_path = path
-        self.drive = drive  # type: str
-        self.path = PurePosixPath(path, item['Path'])
+        self.drive: str = sys.intern(drive)
+        fullpath = PurePosixPath(path, item['Path'])
+        self._path: str = str(fullpath)
+        self._parent: Optional[str] = sys.intern(str(fullpath.parent))
+        self.name: str = item['Name']
+        self._size: Optional[int] = None
+        self._container: Optional['RcloneDirectory'] = None  # The loaded directory this item is listed in.
+
+    @property
+    def path(self) -> PurePosixPath:
+        return PurePosixPath(self._path)
+
+    @property
+    def fullpath(self) -> PurePosixPath:
+        drive = self.drive
         if not drive.endswith(':'):
             drive += ':'
-        self.fullpath = PurePosixPath(drive, self.path)
-        self.name: str = item['Name']
-        self.parent: Optional[PurePosixPath] = self.path.parent
-        self.is_directory: bool = False
-        self._size: int
+        return PurePosixPath(drive, self._path)
+
+    @property
+    def parent(self) -> Optional[PurePosixPath]:
+        if self._parent is None:
+            return None
+        return PurePosixPath(self._parent)
+
+    @parent.setter
+    def parent(self, parent: Optional[PurePosixPath]):
+        self._parent = None if parent is None else sys.intern(str(parent))
 
     def __str__(self):
         return self.name
@@ -80,17 +110,27 @@ class RcloneItem(ABC):
 
 class RcloneFile(RcloneItem):
     """Represents a file on a Rclone Drive"""
+    __slots__ = ('filetype', 'modtime', '_hash')
 
     def __init__(self, item, drive, path):
         super().__init__(item, drive, path)
-        self.filetype: str = item['MimeType']
-        self.purename = self.path.stem
-        self.extension = self.path.suffix
+        self.filetype: str = sys.intern(item['MimeType'])
+        self.modtime: Optional[float] = parse_modtime(item['ModTime']) if item.get('ModTime') else None
         if int(item["Size"]) > 0:
             self._size = int(item['Size'])
         else:
             self._size = 0
-        self._hash: str
+        self._hash: Optional[str] = None
+        if item.get('Hashes'):
+            self._hash = find_md5(item['Hashes'])
+
+    @property
+    def purename(self) -> str:
+        return PurePosixPath(self.name).stem
+
+    @property
+    def extension(self) -> str:
+        return PurePosixPath(self.name).suffix
 
     async def get_size(self) -> int:
         return self._size
@@ -102,61 +142,157 @@ class RcloneFile(RcloneItem):
         return self._hash
 
     async def equals(self, other):
-        """Checks if the given Files are equal."""
+        """Checks if the given Files are equal.
+        Missing hashes get fetched, so fill them in bulk with RcloneDirectory.fetch_hashes beforehand."""
         if not isinstance(other, RcloneFile):
             return False
+        if await self.get_size() != await other.get_size():
+            return False
         hash1 = await self.get_hash()
         hash2 = await other.get_hash()
-        if (hash1 == hash2) and (await self.get_size() == await other.get_size()):
-            return True
-        else:
-            return False
+        return hash1 == hash2
 
     def __eq__(self, other) -> bool:
-        """This only works properly when the files have their hashes pre-filled by calling the coroutine get_hash."""
+        """Compares the pre-filled hashes, see RcloneDirectory.fetch_hashes or the equals coroutine.
+        Without hashes on both sides, only the same file on the same drive is considered equal."""
         if not isinstance(other, RcloneFile):
             return False
-
-        if self._hash is None or other._hash is None:
-            if self._hash is None:
-                loop.run_until_complete(self.get_hash())
-            if other._hash is None:
-                loop.run_until_complete(other.get_hash())
-
-            print("This has blockingly called get_hash since one of these didn't have a hash specified."
-                  "Consider using the equals coroutine instead.")
-
-        if (self._hash == other._hash) and (self._size == other._size):
-            return True
-        else:
+        if self._size != other._size:
             return False
+        if self._hash is None or other._hash is None:
+            return self.fullpath == other.fullpath
+        return self._hash == other._hash
 
 
 class RcloneDirectory(RcloneItem):
     """Represents a folder on a rclone Drive"""
+    __slots__ = ('populated', '_contents', '_amount')
+    is_directory: bool = True
 
     def __init__(self, item, drive, path):
         super().__init__(item, drive, path)
-        self.is_directory: bool = True
         self.populated: bool = False
         self._contents: List[RcloneItem] = []
         self._amount = -1
 
-    async def populate(self):
-        self._contents = await ls(self.drive, self.path)
-        self.populated = True
-
-    async def get_contents(self, recursive: bool = False) -> List[RcloneItem]:
-        if not self.populated:
-            await self.populate()
+    async def populate(self, recursive: bool = False):
+        """Lists this directory on the remote.
+        With recursive, a single flat listing is used to fill the whole subtree."""
+        self._invalidate()
         if recursive:
+            self._contents = []
+            await attach_stream(self, iflatls(self.drive, self.path))
+        else:
+            self._contents = await ls(self.drive, self.path)
+            for item in self._contents:
+                item._container = self
+            self.populated = True
+
+    def add_item(self, item: RcloneItem) -> None:
+        """Adds an item to the loaded contents and updates the cached sizes of this directory and all above it."""
+        self._contents.append(item)
+        item._container = self
+        if isinstance(item, RcloneDirectory):
+            if item._size is None:
+                self._invalidate()
+            else:
+                self._update(item._size, item._amount)
+        else:
+            self._update(item._size or 0, 1)
+
+    def remove_item(self, item: RcloneItem) -> None:
+        """Removes an item from the loaded contents and updates the cached sizes of this directory and all above it."""
+        self._contents.remove(item)
+        item._container = None
+        if isinstance(item, RcloneDirectory):
+            if item._size is None:
+                self._invalidate()
+            else:
+                self._update(-item._size, -item._amount)
+        else:
+            self._update(-(item._size or 0), -1)
+
+    def _update(self, size: int, amount: int) -> None:
+        directory: Optional[RcloneDirectory] = self
+        while directory is not None:
+            if directory._size is not None:
+                directory._size += size
+                directory._amount += amount
+            directory = directory._container
+
+    def _invalidate(self) -> None:
+        directory: Optional[RcloneDirectory] = self
+        while directory is not None:
+            directory._size = None
+            directory._amount = -1
+            directory = directory._container
+
+    def _rollup(self) -> bool:
+        """Sums up sizes and file counts of the loaded subtree in one post-order pass and caches them on every directory.
+        :returns False if some directory in the subtree isn't populated, so the sizes can't be known locally."""
+        order: List[RcloneDirectory] = []
+        stack: List[RcloneDirectory] = [self]
+        while stack:
+            directory = stack.pop()
+            if directory._size is not None:
+                continue
+            if not directory.populated:
+                return False
+            order.append(directory)
+            stack.extend(item for item in directory._contents if isinstance(item, RcloneDirectory))
+        for directory in reversed(order):  # Every directory comes after all directories below it.
+            totalsize = 0
+            amount = 0
+            for item in directory._contents:
+                if isinstance(item, RcloneDirectory):
+                    totalsize += item._size
+                    amount += item._amount
+                else:
+                    totalsize += item._size
+                    amount += 1
+            directory._size = totalsize
+            directory._amount = amount
+        return True
+
+    async def get_contents(self, recursive: bool = False, concurrency: Optional[int] = None) -> List[RcloneItem]:
+        """Returns the contents, listing them first if needed.
+        With recursive, the whole subtree gets loaded with one flat listing, or with a concurrency given,
+        directory by directory with that many listings in flight, see crawl."""
+        if recursive and concurrency:
+            await crawl(self, concurrency)
+        elif not self.populated:
+            await self.populate(recursive)
+        elif recursive:
             for item in self._contents:
                 if isinstance(item, RcloneDirectory):
                     await item.get_contents(True)
         return self._contents
 
+    def files(self, recursive: bool = True) -> Dict[str, RcloneFile]:
+        """Returns the loaded files, keyed by their path relative to this directory."""
+        files: Dict[str, RcloneFile] = {}
+        stack: List[Tuple[RcloneDirectory, str]] = [(self, "")]
+        while stack:
+            directory, prefix = stack.pop()
+            for item in directory._contents:
+                if isinstance(item, RcloneFile):
+                    files[prefix + item.name] = item
+                elif recursive and isinstance(item, RcloneDirectory):
+                    stack.append((item, prefix + item.name + "/"))
+        return files
+
+    async def fetch_hashes(self, recursive: bool = True) -> None:
+        """Fills in the hashes of all contained files with a single md5sum call over this directory."""
+        await self.get_contents(recursive)
+        files = self.files(recursive)
+        for relpath, hash in (await hashes(self.fullpath, recursive)).items():
+            file = files.get(relpath)
+            if file is not None:
+                file._hash = hash
+
     async def get_size(self):
-        if self._size is None:
+        """Sums up the loaded contents when the whole subtree is loaded, otherwise asks rclone."""
+        if self._size is None and not self._rollup():
             self._amount, self._size = await size(self.fullpath)
         if self._size < 0:
             self._size = 0
@@ -175,92 +311,566 @@ class RcloneDirectory(RcloneItem):
         return None
 
     def __repr__(self):
-        return f"RcloneDirectory({self._item}, {self.drive}, {self._orig_path})"
+        return f"RcloneDirectory({self.drive}, {self._path})"
+
+
+async def crawl(root: RcloneDirectory, concurrency: int = 4, max_depth: Optional[int] = None,
+                progress: Optional[Callable[[int, int], None]] = None,
+                on_directory: Optional[Callable[[RcloneDirectory], Awaitable[None]]] = None) -> RcloneDirectory:
+    """Populates the tree below root breadth first, listing up to concurrency directories at once.
+    Use this instead of a flat listing when the remote doesn't support --fast-list or the listing would be too large.
+    Directories that are already populated aren't listed again, but are still descended into.
+    Cancelling the crawl cancels all listings in flight.
+    :param max_depth How many levels below root get populated, 0 only populates root, None populates everything.
+    :param progress Called with the amount of listed and discovered directories after every listing.
+    :param on_directory Awaited with every directory right after it got listed, while the crawl goes on elsewhere.
+    :returns The root"""
+    queue: asyncio.Queue = asyncio.Queue()
+    queue.put_nowait((root, 0))
+    discovered = 1
+    listed = 0
+
+    async def work() -> None:
+        nonlocal discovered, listed
+        while True:
+            directory, depth = await queue.get()
+            try:
+                if not directory.populated:
+                    await directory.populate()
+                if on_directory is not None:
+                    await on_directory(directory)
+                listed += 1
+                if max_depth is None or depth < max_depth:
+                    for item in directory._contents:
+                        if isinstance(item, RcloneDirectory):
+                            discovered += 1
+                            queue.put_nowait((item, depth + 1))
+                if progress is not None:
+                    progress(listed, discovered)
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.ensure_future(work()) for _ in range(max(concurrency, 1))]
+    finished = asyncio.ensure_future(queue.join())
+    try:
+        done, _ = await asyncio.wait([finished, *workers], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task is not finished:
+                task.result()  # A worker only stops early when a listing failed, so this raises its error.
+    finally:
+        for task in [finished, *workers]:
+            task.cancel()
+        await asyncio.gather(finished, *workers, return_exceptions=True)
+    return root
 
 
-async def ls(drive: str, directory: Union[str, PurePosixPath], recursive_flat: bool = False) -> List[RcloneItem]:
+async def decode_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Decodes a JSON array piece by piece and yields every element as soon as it is complete.
+    :param chunks The raw bytes of the array, split at arbitrary places."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ""
+    started = False
+    finished = False
+    async for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        pos = 0
+        while not finished:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError(f"Expected a JSON array, got {buffer[pos:pos + 20]!r}")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                finished = True
+                break
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # The element isn't complete yet, wait for more data.
+            if buffer[pos] not in '{["' and buffer[end:].lstrip()[:1] not in (',', ']'):
+                break  # A number like 12 or 1.5e could go on in the next chunk, so wait for the , or ] after it.
+            pos = end
+            yield element
+        buffer = buffer[pos:]
+    buffer += utf8.decode(b'', final=True)
+    if not finished and (started or buffer.strip()):
+        raise ValueError("The JSON array ended prematurely.")
+
+
+def make_item(item: dict, drive: str, directory: Union[str, PurePosixPath]) -> RcloneItem:
+    if not item['IsDir']:
+        return RcloneFile(item, drive, directory)
+    else:
+        return RcloneDirectory(item, drive, directory)
+
+
+async def lsjson(drive: str, directory: Union[str, PurePosixPath],
+                 recursive_flat: bool = False, with_hashes: bool = False) -> AsyncIterator[dict]:
+    """Yields the raw lsjson entries of the directory as soon as rclone outputs them.
+    With with_hashes, the entries include the hashes, so RcloneFiles made from them come with their MD5."""
     if not isinstance(directory, PurePosixPath):
         directory = PurePosixPath(directory)
     if not drive.endswith(':'):
         drive += ':'
     src = PurePosixPath(drive, directory)
     if recursive_flat:
-        res = await asyncrun('rclone', 'lsjson', str(src), rclone_flags, "-R")
+        # Whole trees can be huge, so they are streamed and never cached.
+        items = _stream_list(src, with_hashes, recursive=True)
     else:
-        res = await asyncrun('rclone', 'lsjson', str(src), rclone_flags)
-    result = decode(res)
-    results: List[RcloneItem] = []
-    for item in result:
-        if not item['IsDir']:
-            results.append(RcloneFile(item, drive, directory))
-        else:
-            new_directory = RcloneDirectory(item, drive, directory)
-            results.append(new_directory)
+        # Single directories are asked for repeatedly, so they go through the cache, streamed on a miss.
+        key = ('lsjson', normalize(src), str(with_hashes))
+        items = cache.stream(key, [src], lambda: _stream_list(src, with_hashes))
+    async for item in items:
+        yield item
+
+
+async def _stream_list(src: PurePosixPath, with_hashes: bool, recursive: bool = False) -> AsyncIterator[dict]:
+    if rc is not None:
+        opt: Dict[str, Any] = {'recurse': recursive, 'showHash': with_hashes}
+        if with_hashes:
+            opt['hashTypes'] = ['MD5']
+        result = await rc.call('operations/list', fs=str(src), remote="", opt=opt)
+        for item in result['list']:
+            yield item
+        return
+    args = ['lsjson', str(src), rclone_flags]
+    if recursive:
+        args.append("-R")
+    if with_hashes:
+        args.extend(['--hash', '--hash-type', 'MD5'])
+    async for item in decode_stream(asyncrun_stream('rclone', *args)):
+        yield item
+
+
+async def ils(drive: str, directory: Union[str, PurePosixPath],
+              recursive_flat: bool = False, with_hashes: bool = False) -> AsyncIterator[RcloneItem]:
+    """Lists the directory like ls, but yields every item as soon as rclone outputs it.
+    Only one item of the listing needs to be held in memory at a time."""
+    if not drive.endswith(':'):
+        drive += ':'
+    async for item in lsjson(drive, directory, recursive_flat, with_hashes):
+        yield make_item(item, drive, directory)
 
-    return results
 
+async def ls(drive: str, directory: Union[str, PurePosixPath], recursive_flat: bool = False) -> List[RcloneItem]:
+    return [item async for item in ils(drive, directory, recursive_flat)]
 
-async def tree(drive: str = "Drive", directory: Union[str, PurePosixPath] = "") -> RcloneDirectory:
-    if not isinstance(directory, PurePosixPath):
-        directory = PurePosixPath(directory)
 
-    async def fill_path(path: RcloneDirectory, items: list):
-        for item in items:
-            if item.parent == path.path:
-                path._contents.append(item)
+class TreeBuilder:
+    """Sorts a flat listing below a root directory into a tree, one item at a time.
+    Every directory gets indexed by its path, so each item only needs one lookup to find its parent.
+    The items may come in any order, items whose parent wasn't seen yet are held back until it shows up."""
 
-        path.populated = True
+    def __init__(self, root: RcloneDirectory):
+        self.root = root
+        self._index: Dict[str, RcloneDirectory] = {root._path: root}
+        self._orphans: Dict[Optional[str], List[RcloneItem]] = {}
 
+    def add(self, item: RcloneItem) -> None:
+        parent = self._index.get(item._parent)
+        if parent is not None:
+            parent._contents.append(item)
+            item._container = parent
+        else:
+            self._orphans.setdefault(item._parent, []).append(item)
+        if isinstance(item, RcloneDirectory):
+            self._index[item._path] = item
+            item.populated = True
+            waiting = self._orphans.pop(item._path, None)
+            if waiting:
+                item._contents.extend(waiting)
+                for child in waiting:
+                    child._container = item
+
+    def finish(self) -> RcloneDirectory:
+        self.root.populated = True
+        return self.root
+
+
+def attach(root: RcloneDirectory, items: Iterable[RcloneItem]) -> RcloneDirectory:
+    """Sorts a flat listing below root into a tree in a single pass.
+    :param root The directory the listing was made from, its contents get extended.
+    :param items The flat listing, like the one returned by flatls.
+    :returns The root, with all directories below it populated."""
+    builder = TreeBuilder(root)
+    for item in items:
+        builder.add(item)
+    return builder.finish()
+
+
+async def attach_stream(root: RcloneDirectory, items: AsyncIterator[RcloneItem]) -> RcloneDirectory:
+    """Like attach, but consumes a streamed listing like the one from iflatls."""
+    builder = TreeBuilder(root)
+    async for item in items:
+        builder.add(item)
+    return builder.finish()
+
+
+def directory_at(drive: str, directory: Union[str, PurePosixPath] = "") -> RcloneDirectory:
+    """Returns a not yet populated RcloneDirectory for the path, to populate or crawl."""
+    if not isinstance(directory, PurePosixPath):
+        directory = PurePosixPath(directory)
     item = {'Path': directory, 'Name': directory.name, 'IsDir': True}
     root = RcloneDirectory(item, drive, "")
-    if directory == "":
+    if directory == PurePosixPath(""):
         root.parent = None
-    fulltree: List[RcloneItem] = await flatls(drive, directory)
-    fulltree.append(root)
-    for file in fulltree:
-        if isinstance(file, RcloneDirectory):
-            await fill_path(file, fulltree)
     return root
 
 
+async def tree(drive: str = "Drive", directory: Union[str, PurePosixPath] = "",
+               with_hashes: bool = False) -> RcloneDirectory:
+    root = directory_at(drive, directory)
+    return await attach_stream(root, iflatls(drive, directory, with_hashes))
+
+
 async def flatls(drive: str, directory: Union[str, PurePosixPath]) -> List[RcloneItem]:
     return await ls(drive, directory, recursive_flat=True)
 
 
+def iflatls(drive: str, directory: Union[str, PurePosixPath], with_hashes: bool = False) -> AsyncIterator[RcloneItem]:
+    return ils(drive, directory, recursive_flat=True, with_hashes=with_hashes)
+
+
+no_modtime = -2 ** 63
+
+
+class RcloneListing:
+    """A whole flat listing stored column by column instead of as one object per item.
+    Names are kept as strings, everything else in compact arrays, folders are referenced by index.
+    Modtimes are kept in nanoseconds, no_modtime marks the items that have none.
+    The RcloneFile and RcloneDirectory objects only get created when an item is accessed."""
+
+    def __init__(self, drive: str, directory: Union[str, PurePosixPath] = ""):
+        if not drive.endswith(':'):
+            drive += ':'
+        self.drive = drive
+        self.directory = PurePosixPath(directory)
+        self._names: List[str] = []
+        self._parents = array('l')
+        self._sizes = array('q')
+        self._modtimes = array('q')
+        self._isdir = bytearray()
+        self._mimetypes = array('H')
+        self._folders: List[str] = []
+        self._folder_index: Dict[str, int] = {}
+        self._mimetype_table: List[str] = []
+        self._mimetype_index: Dict[str, int] = {}
+
+    @classmethod
+    async def fetch(cls, drive: str, directory: Union[str, PurePosixPath] = "") -> 'RcloneListing':
+        """Lists the whole directory recursively straight into the columns."""
+        listing = cls(drive, directory)
+        async for item in lsjson(drive, directory, recursive_flat=True):
+            listing.append(item)
+        return listing
+
+    def _lookup(self, table: List[str], index: Dict[str, int], value: str) -> int:
+        position = index.get(value)
+        if position is None:
+            position = index[value] = len(table)
+            table.append(value)
+        return position
+
+    def append(self, item: dict) -> None:
+        path = PurePosixPath(self.directory, item['Path'])
+        self._names.append(item['Name'])
+        self._parents.append(self._lookup(self._folders, self._folder_index, str(path.parent)))
+        self._sizes.append(max(int(item.get('Size', 0)), 0))
+        self._modtimes.append(round(parse_modtime(item['ModTime']) * 1e9) if item.get('ModTime') else no_modtime)
+        self._isdir.append(bool(item['IsDir']))
+        self._mimetypes.append(self._lookup(self._mimetype_table, self._mimetype_index, item.get('MimeType', '')))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __getitem__(self, index: int) -> RcloneItem:
+        if index < 0:
+            index += len(self)
+        parent = self._folders[self._parents[index]]
+        name = self._names[index]
+        item = {'Path': str(PurePosixPath(parent, name)), 'Name': name, 'Size': self._sizes[index],
+                'MimeType': self._mimetype_table[self._mimetypes[index]], 'IsDir': bool(self._isdir[index])}
+        made = make_item(item, self.drive, "")
+        if isinstance(made, RcloneFile) and self._modtimes[index] != no_modtime:
+            made.modtime = self._modtimes[index] / 1e9
+        return made
+
+    def __iter__(self) -> Iterator[RcloneItem]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def total_size(self) -> int:
+        return sum(self._sizes)
+
+
 async def size(full_path: Union[str, PurePosixPath]) -> Tuple[int, int]:
-    result = await asyncrun('rclone', 'size', full_path, '--json', rclone_flags)
-    results = decode(result)
+    return await cache.get(('size', normalize(full_path)), [full_path], lambda: _size(full_path))
+
+
+async def _size(full_path: Union[str, PurePosixPath]) -> Tuple[int, int]:
+    if rc is not None:
+        results = await rc.call('operations/size', fs=str(full_path))
+    else:
+        result = await asyncrun('rclone', 'size', full_path, '--json', rclone_flags)
+        results = decode(result)
     amount = int(results['count'])
     totalsize = int(results['bytes'])
     return amount, totalsize
 
 
 async def fetch_hash(full_path: Union[str, PurePosixPath]) -> str:
+    return await cache.get(('md5sum', normalize(full_path)), [full_path], lambda: _fetch_hash(full_path))
+
+
+async def _fetch_hash(full_path: Union[str, PurePosixPath]) -> str:
+    if rc is not None:
+        result = await rc.call('operations/hashsum', fs=str(full_path), hashType='md5')
+        return "\n".join(result['hashsum'])
     res = await asyncrun('rclone', 'md5sum', full_path, rclone_flags)
     return res
 
 
+def parse_modtime(modtime: str) -> float:
+    """Turns an lsjson ModTime like 2019-12-24T18:00:00.123456789+01:00 into a unix timestamp.
+    The fraction can have up to nine digits, which datetime can't parse on its own."""
+    seconds = datetime.datetime.strptime(modtime[:19], '%Y-%m-%dT%H:%M:%S')
+    rest = modtime[19:]
+    fraction = 0.0
+    if rest.startswith('.'):
+        digits = len(rest) - len(rest[1:].lstrip('0123456789'))
+        fraction = float(rest[:digits])
+        rest = rest[digits:]
+    offset = datetime.timedelta()
+    if rest not in ("", "Z"):
+        sign = -1 if rest[0] == '-' else 1
+        hours, minutes = rest[1:].split(':')
+        offset = sign * datetime.timedelta(hours=int(hours), minutes=int(minutes))
+    return (seconds - offset).replace(tzinfo=datetime.timezone.utc).timestamp() + fraction
+
+
+def find_md5(hashes: Dict[str, str]) -> Optional[str]:
+    """Picks the MD5 out of the Hashes of an lsjson entry, older rclone versions spell it in capitals."""
+    for name, hash in hashes.items():
+        if name.lower() == 'md5' and hash:
+            return hash
+    return None
+
+
+def parse_md5sum(output: str) -> Dict[str, str]:
+    """Parses md5sum output into a dict of relative path to hash.
+    Files the remote has no hash for are left out."""
+    results: Dict[str, str] = {}
+    for line in output.splitlines():
+        hash, path = line[:32].strip(), line[34:]
+        if hash and path:
+            results[path] = hash
+    return results
+
+
+async def hashes(full_path: Union[str, PurePosixPath], recursive: bool = True) -> Dict[str, str]:
+    """Fetches the hashes of all files below the path in one go."""
+    key = ('md5sum', normalize(full_path), str(recursive))
+    return await cache.get(key, [full_path], lambda: _hashes(full_path, recursive))
+
+
+async def _hashes(full_path: Union[str, PurePosixPath], recursive: bool) -> Dict[str, str]:
+    if rc is not None:
+        params: Dict[str, Any] = {'fs': str(full_path), 'hashType': 'md5'}
+        if not recursive:
+            params['_filter'] = {'MaxDepth': 1}
+        result = await rc.call('operations/hashsum', **params)
+        return parse_md5sum("\n".join(result['hashsum']))
+    if recursive:
+        res = await asyncrun('rclone', 'md5sum', full_path, rclone_flags)
+    else:
+        res = await asyncrun('rclone', 'md5sum', full_path, rclone_flags, '--max-depth', '1')
+    return parse_md5sum(res)
+
+
+async def _rc_transfer(file_command: str, dir_command: str,
+                       src_full_path: Union[str, PurePath], dest_full_path: Union[str, PurePath]):
+    """Copies or moves like the rclone command line does: a file source ends up inside the destination folder."""
+    assert rc is not None
+    src_fs, src_remote = split_remote(src_full_path)
+    stat = await rc.call('operations/stat', fs=src_fs, remote=src_remote)
+    if stat.get('item') and not stat['item']['IsDir']:
+        await rc.call(file_command, srcFs=src_fs, srcRemote=src_remote, dstFs=str(dest_full_path),
+                      dstRemote=stat['item']['Name'], _config=checksum_config)
+    else:
+        await rc.call(dir_command, srcFs=str(src_full_path), dstFs=str(dest_full_path), _config=checksum_config)
+
+
 async def copy(src_full_path: Union[str, PurePath], dest_full_path: Union[str, PurePath]):
-    await asyncrun('rclone', 'copy', src_full_path, dest_full_path, '-c', rclone_flags)
+    try:
+        if rc is not None:
+            await _rc_transfer('operations/copyfile', 'sync/copy', src_full_path, dest_full_path)
+        else:
+            await asyncrun('rclone', 'copy', src_full_path, dest_full_path, '-c', rclone_flags)
+    finally:
+        cache.invalidate(dest_full_path)
 
 
 async def move(src_full_path: Union[str, PurePath], dest_full_path: Union[str, PurePath]):
-    await asyncrun('rclone', 'move', src_full_path, dest_full_path, '-c', rclone_flags)
+    try:
+        if rc is not None:
+            await _rc_transfer('operations/movefile', 'sync/move', src_full_path, dest_full_path)
+        else:
+            await asyncrun('rclone', 'move', src_full_path, dest_full_path, '-c', rclone_flags)
+    finally:
+        cache.invalidate(src_full_path, dest_full_path)
+
+
+async def moveto(src_full_path: Union[str, PurePath], dest_full_path: Union[str, PurePath]):
+    """Moves or renames a single file to exactly the given destination path."""
+    try:
+        if rc is not None:
+            src_fs, src_remote = split_remote(src_full_path)
+            dest_fs, dest_remote = split_remote(dest_full_path)
+            await rc.call('operations/movefile', srcFs=src_fs, srcRemote=src_remote, dstFs=dest_fs,
+                          dstRemote=dest_remote, _config=checksum_config)
+        else:
+            await asyncrun('rclone', 'moveto', src_full_path, dest_full_path, '-c', rclone_flags)
+    finally:
+        cache.invalidate(src_full_path, dest_full_path)
+
+
+async def copy_files(files: Iterable[RcloneFile], src_full_path: Union[str, PurePath],
+                     dest_full_path: Union[str, PurePath], transfers: int = 8) -> Dict[str, bool]:
+    """Copies many files below a common source folder into the destination with a single rclone call.
+    The folder structure below the source is kept.
+    :returns Whether each file was copied, keyed by its path relative to the source folder."""
+    return await _transfer_files('copy', files, src_full_path, dest_full_path, transfers)
+
+
+async def move_files(files: Iterable[RcloneFile], src_full_path: Union[str, PurePath],
+                     dest_full_path: Union[str, PurePath], transfers: int = 8) -> Dict[str, bool]:
+    """Moves many files below a common source folder into the destination with a single rclone call.
+    The folder structure below the source is kept.
+    :returns Whether each file was moved, keyed by its path relative to the source folder."""
+    return await _transfer_files('move', files, src_full_path, dest_full_path, transfers)
+
+
+async def delete_files(files: Iterable[RcloneFile], root_full_path: Union[str, PurePath]) -> Dict[str, bool]:
+    """Deletes many files below a common folder with a single rclone call.
+    :returns Whether each file was deleted, keyed by its path relative to the folder."""
+    return await _transfer_files('delete', files, root_full_path, None, 0)
+
+
+def parse_json_log(log: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+    """Finds the objects rclone reported as transferred and as failed in a --use-json-log log.
+    :returns The transferred and the failed object paths."""
+    transferred: Set[str] = set()
+    failed: Set[str] = set()
+    for line in log:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        name = entry.get('object')
+        if not name:
+            continue
+        if entry.get('level') == 'error':
+            failed.add(name)
+        elif entry.get('msg', '').startswith(('Copied', 'Moved', 'Deleted')):
+            transferred.add(name)
+    return transferred, failed
+
+
+def relative_to(full_path: Union[str, PurePath], folder: Union[str, PurePath]) -> str:
+    """The path of full_path below folder, however the two are spelled, like Drive:/Videos/a.mkv below Drive:Videos.
+    :raises ValueError If full_path isn't below the folder."""
+    path, folder = normalize(full_path), normalize(folder)
+    prefix = folder if folder.endswith(':') or folder == '/' else folder + '/'
+    if not path.startswith(prefix) or path == prefix:
+        raise ValueError(f"{full_path} isn't below {folder}")
+    return path[len(prefix):]
+
+
+async def _transfer_files(command: str, files: Iterable[RcloneFile], src_full_path: Union[str, PurePath],
+                          dest_full_path: Optional[Union[str, PurePath]], transfers: int) -> Dict[str, bool]:
+    """Runs rclone copy, move or delete restricted to the given files with --files-from-raw.
+    This always uses the command line, since the rc backend can't read a files-from list."""
+    relpaths = [relative_to(file.fullpath, src_full_path) for file in files]
+    if not relpaths:
+        return {}
+    with tempfile.TemporaryDirectory() as tempdir:
+        files_from = Path(tempdir, 'files-from.txt')
+        logfile = Path(tempdir, 'rclone.log')
+        files_from.write_text("\n".join(relpaths) + "\n", encoding='utf-8')
+        if dest_full_path is None:
+            args = [command, src_full_path, '--drive-use-trash=true']
+        else:
+            args = [command, src_full_path, dest_full_path, '--transfers', transfers, '-c']
+        try:
+            await asyncrun('rclone', *args, '--files-from-raw', files_from, rclone_flags,
+                           '--use-json-log', '--log-level', 'INFO', '--log-file', logfile)
+            succeeded = True
+        except subprocess.CalledProcessError:
+            succeeded = False  # Some transfers failed, the log tells which ones.
+        finally:
+            if command == 'copy':
+                cache.invalidate(dest_full_path)
+            else:
+                cache.invalidate(src_full_path, *([dest_full_path] if dest_full_path is not None else []))
+        if logfile.exists():
+            with logfile.open(encoding='utf-8') as log:
+                transferred, failed = parse_json_log(log)
+        else:
+            transferred, failed = set(), set()
+    if succeeded:
+        return {relpath: relpath not in failed for relpath in relpaths}
+    return {relpath: relpath in transferred and relpath not in failed for relpath in relpaths}
 
 
 async def delete_file(full_path: Union[str, PurePosixPath]):
-    await asyncrun('rclone', 'deletefile', full_path, rclone_flags, '--drive-use-trash=true')
+    try:
+        if rc is not None:
+            fs, remote = split_remote(full_path)
+            await rc.call('operations/deletefile', fs=fs, remote=remote)
+        else:
+            await asyncrun('rclone', 'deletefile', full_path, rclone_flags, '--drive-use-trash=true')
+    finally:
+        cache.invalidate(full_path)
 
 
 async def sync(src_full_path: Union[str, PurePath], dest_full_path: Union[str, PurePath], *args):
-    await asyncrun('rclone', 'sync', src_full_path, dest_full_path, '-c', rclone_flags, *args)
+    """Syncs the destination to the source.
+    Extra command line flags can't be passed to the rc backend, so with those the command line is always used."""
+    try:
+        if rc is not None and not args:
+            await rc.call('sync/sync', srcFs=str(src_full_path), dstFs=str(dest_full_path), _config=checksum_config)
+        else:
+            await asyncrun('rclone', 'sync', src_full_path, dest_full_path, '-c', rclone_flags, *args)
+    finally:
+        cache.invalidate(dest_full_path)
+
+
+async def use_rc(addr: str = "localhost:5572") -> RcloneRC:
+    """Switches this process to a persistent rclone rcd daemon instead of one rclone process per operation."""
+    global rc
+    if rc is None:
+        backend = RcloneRC(addr, flags=[rclone_flags, '--drive-use-trash=true'])
+        await backend.start()
+        rc = backend
+    return rc
+
+
+async def use_subprocess() -> None:
+    """Switches back to running one rclone process per operation and stops the daemon."""
+    global rc
+    if rc is not None:
+        backend, rc = rc, None
+        await backend.close()
 
 
 async def main():
-    global loop
     import GUI
-    loop = asyncio.get_running_loop()
-    nest_asyncio.apply()
     event, values = GUI.rclonewindow()
     if event == 'OK':
         drive = values[0]
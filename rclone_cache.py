@@ -0,0 +1,181 @@
+import asyncio
+import sniffio
+import time
+from collections import OrderedDict
+from pathlib import PurePath
+from loguru import logger
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+log = logger
+Key = Tuple[str, ...]
+
+
+def normalize(path: Union[str, PurePath]) -> str:
+    """Brings the different spellings of a rclone path, like Drive:/Videos/ and Drive:Videos, into one form."""
+    path = str(path)
+    if ':' in path and not path.startswith('/'):
+        drive, rest = path.split(':', 1)
+        rest = rest.strip('/')
+        return f"{drive}:{'' if rest == '.' else rest}"
+    return path.rstrip('/') or '/'
+
+
+def overlaps(first: str, second: str) -> bool:
+    """Whether one of the normalized paths is the other or lies below it."""
+    if first == second:
+        return True
+    shorter, longer = sorted((first, second), key=len)
+    if shorter.endswith(':') or shorter == '/':
+        return longer.startswith(shorter)
+    return longer.startswith(shorter + '/')
+
+
+def new_event() -> Any:
+    """An event of the async library that is running, asyncio or trio."""
+    if sniffio.current_async_library() == 'trio':
+        import trio
+        return trio.Event()
+    return asyncio.Event()
+
+
+class Flight:
+    """A request that is running, identical requests wait for it instead of starting their own."""
+    __slots__ = ('paths', 'done', 'finished', 'value', 'error')
+
+    def __init__(self, paths: Tuple[str, ...]):
+        self.paths = paths
+        self.done = new_event()
+        self.finished = False  # Whether value holds the result.
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class CommandCache:
+    """Memoizes the results of read only rclone commands like lsjson, size and md5sum.
+    Identical requests that come in while one is running share it instead of starting another rclone.
+    Results expire after ttl seconds, and only the max_entries most recently used ones are kept.
+    Everything touching a path gets dropped by invalidate, which the modifying functions in rclone call.
+    Works with asyncio and trio: the running request belongs to the caller that started it, and if that one
+    gets cancelled, one of the callers waiting for it starts the request again."""
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 1024):
+        self.enabled = True
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Key, Tuple[float, Tuple[str, ...], Any]]' = OrderedDict()
+        self._inflight: Dict[Key, Flight] = {}
+
+    async def get(self, key: Key, paths: Iterable[Union[str, PurePath]],
+                  fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the cached result for key, or fetches it.
+        :param paths The paths the result depends on, for invalidation.
+        :param fetch Produces the result, only called when neither a cached nor a running request exists."""
+        if not self.enabled:
+            return await fetch()
+        found, value = await self._join(key)
+        if found:
+            return value
+        flight = self._start(key, paths)
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:  # An Exception on Python 3.7, but the waiting callers should retry.
+            raise
+        except Exception as error:
+            flight.error = error
+            raise
+        else:
+            self._finish(key, flight, value)
+            return value
+        finally:
+            self._land(key, flight)
+
+    async def stream(self, key: Key, paths: Iterable[Union[str, PurePath]],
+                     fetch: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Like get for a result that arrives piece by piece, like a streamed listing.
+        The first caller gets the pieces as they arrive, and they are stored as a list once all are there.
+        :param fetch Yields the pieces."""
+        if not self.enabled:
+            async for piece in fetch():
+                yield piece
+            return
+        found, value = await self._join(key)
+        if found:
+            for piece in value:
+                yield piece
+            return
+        flight = self._start(key, paths)
+        pieces: List[Any] = []
+        try:
+            async for piece in fetch():
+                pieces.append(piece)
+                yield piece
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            flight.error = error
+            raise
+        else:
+            self._finish(key, flight, pieces)
+        finally:
+            self._land(key, flight)
+
+    async def _join(self, key: Key) -> Tuple[bool, Any]:
+        """Looks for a cached result, or waits for a running request.
+        :returns Whether there was a result, and the result."""
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, _, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            flight = self._inflight.get(key)
+            if flight is None:
+                return False, None
+            await flight.done.wait()
+            if flight.finished:
+                self.hits += 1
+                return True, flight.value
+            if flight.error is not None:
+                raise flight.error
+            # It got cancelled, so look again, maybe running the request ourselves this time.
+
+    def _start(self, key: Key, paths: Iterable[Union[str, PurePath]]) -> Flight:
+        self.misses += 1
+        flight = Flight(tuple(normalize(path) for path in paths))
+        self._inflight[key] = flight
+        return flight
+
+    def _finish(self, key: Key, flight: Flight, value: Any) -> None:
+        """Keeps the result, unless its request got invalidated while it was running."""
+        flight.value = value
+        flight.finished = True
+        if self._inflight.get(key) is not flight:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, flight.paths, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _land(self, key: Key, flight: Flight) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        flight.done.set()
+
+    def invalidate(self, *paths: Union[str, PurePath]) -> None:
+        """Forgets every result that depends on one of the paths, or on anything above or below them.
+        Requests still running for those paths won't be stored either."""
+        changed = [normalize(path) for path in paths]
+        for key in [key for key, (_, entry_paths, _) in self._entries.items()
+                    if any(overlaps(path, other) for path in changed for other in entry_paths)]:
+            del self._entries[key]
+        for key, flight in list(self._inflight.items()):
+            if any(overlaps(path, other) for path in changed for other in flight.paths):
+                del self._inflight[key]  # Its waiters still get the result, but it won't be stored.
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._inflight.clear()
@@ -0,0 +1,149 @@
+import asyncio
+from enum import Enum
+from pathlib import PurePosixPath
+from loguru import logger
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import rclone
+from rclone import RcloneDirectory, RcloneFile
+
+log = logger
+hash_all_threshold = 32  # With more files than this to hash on one side, one md5sum over the whole tree is cheaper.
+
+
+class ChangeType(Enum):
+    NEW = "new"
+    CHANGED = "changed"
+    DELETED = "deleted"
+    MOVED = "moved"
+
+
+class Change(NamedTuple):
+    """One difference between the source and the destination tree.
+    path is relative to the roots, for moves old_path is where the file currently is on the destination."""
+    type: ChangeType
+    path: str
+    source: Optional[RcloneFile] = None
+    destination: Optional[RcloneFile] = None
+    old_path: Optional[str] = None
+
+
+class SyncPlan:
+    """The changes needed to make the destination tree equal to the source tree."""
+
+    def __init__(self, source: RcloneDirectory, destination: RcloneDirectory, changes: List[Change]):
+        self.source = source
+        self.destination = destination
+        self.changes = changes
+
+    def of_type(self, type: ChangeType) -> List[Change]:
+        return [change for change in self.changes if change.type is type]
+
+    def __len__(self) -> int:
+        return len(self.changes)
+
+    def __str__(self) -> str:
+        counts = ", ".join(f"{len(self.of_type(type))} {type.value}" for type in ChangeType)
+        return f"Sync plan from {self.source.fullpath} to {self.destination.fullpath}: {counts}"
+
+
+async def fill_hashes(directory: RcloneDirectory, files: List[RcloneFile]) -> None:
+    """Makes sure the given files below the directory have their hashes, with as few rclone calls as possible."""
+    missing = [file for file in files if file._hash is None]
+    if len(missing) > hash_all_threshold:
+        await directory.fetch_hashes(recursive=True)
+    elif missing:
+        await asyncio.gather(*(file.get_hash() for file in missing))
+
+
+def same_hash(first: RcloneFile, second: RcloneFile) -> bool:
+    """Only says yes if both sides actually know their hash, remotes without MD5 support never match."""
+    return first._hash is not None and first._hash != "" and first._hash == second._hash
+
+
+async def diff(source: RcloneDirectory, destination: RcloneDirectory, modify_window: float = 1.0,
+               detect_moves: bool = True) -> SyncPlan:
+    """Compares two trees by path, size and modification time, and by hash only where those don't decide.
+    Both trees get loaded with one listing each if they aren't already.
+    A local folder can be compared by loading it with rclone.tree("", "/absolute/path").
+    :param modify_window Modification times closer than this many seconds count as equal.
+    :param detect_moves Whether files that only vanished on one path and appeared on another with the same hash
+    should be moved on the destination instead of being uploaded again.
+    :returns The plan to make the destination equal to the source."""
+    await asyncio.gather(source.get_contents(recursive=True), destination.get_contents(recursive=True))
+    source_files = source.files()
+    destination_files = destination.files()
+    changes: List[Change] = []
+    undecided: List[str] = []
+    for path, file in source_files.items():
+        other = destination_files.get(path)
+        if other is None:
+            continue
+        if file._size != other._size:
+            changes.append(Change(ChangeType.CHANGED, path, file, other))
+        elif file.modtime is None or other.modtime is None or abs(file.modtime - other.modtime) > modify_window:
+            undecided.append(path)
+    new = [path for path in source_files if path not in destination_files]
+    deleted = [path for path in destination_files if path not in source_files]
+
+    # Only sizes that show up on both sides can be moves, so only those need hashes.
+    candidates: Dict[int, List[str]] = {}
+    if detect_moves:
+        deleted_sizes = {destination_files[path]._size for path in deleted}
+        for path in new:
+            size = source_files[path]._size
+            if size in deleted_sizes:
+                candidates.setdefault(size, []).append(path)
+    moved_from = [path for path in deleted if destination_files[path]._size in candidates]
+    moved_to = [path for paths in candidates.values() for path in paths]
+    await asyncio.gather(
+        fill_hashes(source, [source_files[path] for path in undecided + moved_to]),
+        fill_hashes(destination, [destination_files[path] for path in undecided + moved_from]))
+
+    for path in undecided:
+        if not same_hash(source_files[path], destination_files[path]):
+            changes.append(Change(ChangeType.CHANGED, path, source_files[path], destination_files[path]))
+
+    moved_new = set()
+    moved_old = set()
+    unclaimed: Dict[Optional[str], List[str]] = {}
+    for path in moved_from:
+        unclaimed.setdefault(destination_files[path]._hash, []).append(path)
+    for path in moved_to:
+        file = source_files[path]
+        olds = unclaimed.get(file._hash) if file._hash else None
+        while olds:
+            old = olds.pop()
+            if same_hash(file, destination_files[old]) and file._size == destination_files[old]._size:
+                changes.append(Change(ChangeType.MOVED, path, file, destination_files[old], old))
+                moved_new.add(path)
+                moved_old.add(old)
+                break
+
+    changes.extend(Change(ChangeType.NEW, path, source_files[path]) for path in new if path not in moved_new)
+    changes.extend(Change(ChangeType.DELETED, path, destination=destination_files[path])
+                   for path in deleted if path not in moved_old)
+    return SyncPlan(source, destination, changes)
+
+
+async def apply(plan: SyncPlan, transfers: int = 8, delete: bool = True) -> Dict[str, bool]:
+    """Carries out the plan: moves on the destination first, then one batched copy and one batched delete.
+    :param delete Whether files missing from the source get deleted on the destination.
+    :returns Whether each change succeeded, keyed by its path."""
+    results: Dict[str, bool] = {}
+    destination = plan.destination.fullpath
+    for change in plan.of_type(ChangeType.MOVED):
+        try:
+            await rclone.moveto(PurePosixPath(destination, change.old_path), PurePosixPath(destination, change.path))
+            results[change.path] = True
+        except Exception as error:
+            log.error(f"Moving {change.old_path} to {change.path} failed: {error}")
+            results[change.path] = False
+    transfer = [change.source for change in plan.changes if change.type in (ChangeType.NEW, ChangeType.CHANGED)]
+    if transfer:
+        results.update(await rclone.copy_files(transfer, plan.source.fullpath, destination, transfers))
+    if delete:
+        removals: Iterable[RcloneFile] = [change.destination for change in plan.of_type(ChangeType.DELETED)]
+        results.update(await rclone.delete_files(removals, destination))
+    log.info(f"Applied {plan}, {sum(not ok for ok in results.values())} failed")
+    return results
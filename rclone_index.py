@@ -0,0 +1,165 @@
+import fnmatch
+import heapq
+import os.path
+import re
+from array import array
+from pathlib import PurePosixPath
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern
+
+from rclone import RcloneDirectory, RcloneItem
+
+try:
+    import re._parser as sre_parse  # type: ignore
+except ImportError:
+    import sre_parse  # type: ignore
+
+
+def trigrams(name: str) -> Iterable[str]:
+    return {name[i:i + 3] for i in range(len(name) - 2)}
+
+
+def glob_literals(pattern: str) -> List[str]:
+    """Returns the literal parts every name matching the glob has to contain."""
+    pattern = re.sub(r'\[[^\]]*\]', '*', pattern)
+    return [part for part in re.split(r'[*?]', pattern) if part]
+
+
+def regex_literals(pattern: str) -> List[str]:
+    """Returns literal runs every string matching the regex has to contain.
+    Only runs at the top level count, anything inside groups, alternations or repeats is skipped."""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+    literals: List[str] = []
+    run = ""
+    for op, value in parsed:
+        if op is sre_parse.LITERAL:
+            run += chr(value)
+            continue
+        if op is sre_parse.BRANCH:
+            return []
+        if run:
+            literals.append(run)
+        run = ""
+    if run:
+        literals.append(run)
+    return literals
+
+
+class NameIndex:
+    """An index over the names of all items in a loaded RcloneDirectory tree.
+    Names are indexed by their lowercase trigrams and their extension, so substring, glob and regex searches
+    only need to check the few names that contain the rarest trigram of the query instead of every item.
+    Searches are case insensitive and return all matching items of the whole tree."""
+
+    def __init__(self, root: RcloneDirectory):
+        self.root = root
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """Indexes the whole tree from scratch, which also drops the postings of removed items."""
+        self._items: List[Optional[RcloneItem]] = []
+        self._names: List[str] = []
+        self._trigrams: Dict[str, array] = {}
+        self._extensions: Dict[str, array] = {}
+        self._dotfiles = array('l')  # Names like .bashrc, which have no extension but match *.bashrc.
+        self._listed: Dict[str, List[int]] = {}  # The full path of an indexed directory to the ids of its contents
+        self._removed = 0
+        self._add_tree(self.root)
+
+    def __len__(self) -> int:
+        return len(self._items) - self._removed
+
+    def _add(self, item: RcloneItem) -> int:
+        number = len(self._items)
+        name = item.name.lower()
+        self._items.append(item)
+        self._names.append(name)
+        for trigram in trigrams(name):
+            postings = self._trigrams.get(trigram)
+            if postings is None:
+                postings = self._trigrams[trigram] = array('l')
+            postings.append(number)
+        extension = os.path.splitext(name)[1]
+        if extension:
+            postings = self._extensions.get(extension)
+            if postings is None:
+                postings = self._extensions[extension] = array('l')
+            postings.append(number)
+        elif name.startswith('.'):
+            self._dotfiles.append(number)
+        return number
+
+    @staticmethod
+    def _key(directory: RcloneDirectory) -> str:
+        return str(directory.fullpath)
+
+    def _add_tree(self, root: RcloneDirectory) -> None:
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            self._listed[self._key(directory)] = [self._add(item) for item in directory._contents]
+            stack.extend(item for item in directory._contents if isinstance(item, RcloneDirectory))
+
+    def _remove_tree(self, root: RcloneDirectory) -> None:
+        """Marks everything listed below root as removed, the postings get cleaned up on the next rebuild."""
+        stack = [self._key(root)]
+        while stack:
+            for number in self._listed.pop(stack.pop(), []):
+                item = self._items[number]
+                if item is None:
+                    continue
+                if isinstance(item, RcloneDirectory):
+                    stack.append(self._key(item))
+                self._items[number] = None
+                self._names[number] = ""
+                self._removed += 1
+
+    def refresh(self, directory: RcloneDirectory) -> None:
+        """Updates the index after the directory below the indexed root got populated again."""
+        self._remove_tree(directory)
+        self._add_tree(directory)
+        if self._removed > len(self):
+            self.rebuild()
+
+    def _candidates(self, literals: Iterable[str]) -> Optional[Iterable[int]]:
+        """Picks the shortest posting list among the trigrams of the literals, None if there isn't any trigram."""
+        best: Optional[array] = None
+        for literal in literals:
+            for trigram in trigrams(literal.lower()):
+                postings = self._trigrams.get(trigram)
+                if postings is None:
+                    return ()
+                if best is None or len(postings) < len(best):
+                    best = postings
+        return best
+
+    def _matching(self, candidates: Optional[Iterable[int]], matches) -> Iterator[RcloneItem]:
+        if candidates is None:
+            candidates = range(len(self._items))
+        for number in candidates:
+            item = self._items[number]
+            if item is not None and matches(self._names[number]):
+                yield item
+
+    def search(self, substring: str) -> List[RcloneItem]:
+        """Finds all items whose name contains the substring."""
+        substring = substring.lower()
+        return list(self._matching(self._candidates([substring]), lambda name: substring in name))
+
+    def glob(self, pattern: str) -> List[RcloneItem]:
+        """Finds all items whose name matches the glob, like *.mkv or Episode ?? *."""
+        pattern = pattern.lower()
+        regex = re.compile(fnmatch.translate(pattern))
+        extension = PurePosixPath(pattern).suffix
+        if extension and pattern == '*' + extension and not any(char in extension for char in '*?['):
+            # Names without an extension can still match when they start with a dot, like .bashrc for *.bashrc.
+            candidates = heapq.merge(self._extensions.get(extension, ()), self._dotfiles)
+            return list(self._matching(candidates, regex.match))
+        return list(self._matching(self._candidates(glob_literals(pattern)), regex.match))
+
+    def regex(self, pattern: str) -> List[RcloneItem]:
+        """Finds all items whose name matches the regex somewhere, ignoring case."""
+        compiled: Pattern = re.compile(pattern, re.IGNORECASE)
+        return list(self._matching(self._candidates(regex_literals(pattern)), compiled.search))
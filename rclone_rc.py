@@ -0,0 +1,95 @@
+import asyncio
+import httpx
+from pathlib import PurePath
+from loguru import logger
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+log = logger
+# httpx 0.9, which requirements.txt pins, names its async client Client and closes it with an async close().
+# Later versions call it AsyncClient, with aclose().
+AsyncClient = getattr(httpx, 'AsyncClient', httpx.Client)
+
+
+class RcloneRCError(Exception):
+    """Raised when the rclone remote control API reports an error."""
+
+    def __init__(self, command: str, status: int, error: str):
+        super().__init__(f"{command} failed with status {status}: {error}")
+        self.command = command
+        self.status = status
+        self.error = error
+
+
+def split_remote(full_path: Union[str, PurePath]) -> Tuple[str, str]:
+    """Splits a full rclone path like Drive:/Videos/a.mkv into the fs (Drive:/Videos) and the remote (a.mkv)."""
+    path = str(full_path).rstrip('/')
+    if '/' in path:
+        fs, remote = path.rsplit('/', 1)
+        return fs or '/', remote
+    if ':' in path:
+        fs, remote = path.split(':', 1)
+        return fs + ':', remote
+    return ".", path
+
+
+class RcloneRC:
+    """Talks to a rclone rcd daemon over its HTTP API.
+    The daemon keeps its config, authentication and remote caches between calls and the
+    HTTP connections are pooled, so every operation only costs a local request."""
+
+    def __init__(self, addr: str = "localhost:5572", flags: Optional[List[str]] = None):
+        self.addr = addr
+        self.url = f"http://{addr}/"
+        self.flags = flags or []
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._client = AsyncClient(timeout=None)
+
+    async def start(self, timeout: float = 30.0) -> None:
+        """Starts the daemon and waits until it answers.
+        If a daemon is already listening on the address, that one is used instead."""
+        if await self._alive():
+            log.info(f"Using the rclone rcd already running on {self.addr}")
+            return
+        log.info(f"Starting rclone rcd on {self.addr}")
+        self._proc = await asyncio.subprocess.create_subprocess_exec(
+            'rclone', 'rcd', '--rc-no-auth', '--rc-addr', self.addr, *self.flags,
+            stdout=asyncio.subprocess.DEVNULL)
+        waited = 0.0
+        while not await self._alive():
+            if self._proc.returncode is not None:
+                raise RuntimeError(f"rclone rcd exited with code {self._proc.returncode}")
+            if waited >= timeout:
+                await self.close()
+                raise TimeoutError(f"rclone rcd didn't answer on {self.addr} within {timeout} seconds")
+            await asyncio.sleep(0.1)
+            waited += 0.1
+
+    async def _alive(self) -> bool:
+        try:
+            await self.call('rc/noop')
+            return True
+        except (httpx.HTTPError, OSError):  # Older httpx versions let connection errors through as they are.
+            return False
+
+    async def call(self, command: str, **params: Any) -> Dict[str, Any]:
+        """Calls the given rc command, like operations/list, and returns its decoded answer."""
+        log.debug(f"Calling rc {command} with {params}")
+        response = await self._client.post(self.url + command, json=params)
+        if response.status_code != 200:
+            try:
+                error = response.json().get('error', response.text)
+            except (ValueError, AttributeError):  # Not an rclone answer, like the error page of a proxy.
+                error = response.text
+            raise RcloneRCError(command, response.status_code, error)
+        return response.json()
+
+    async def close(self) -> None:
+        """Closes the connections and stops the daemon, if it was started by us."""
+        if hasattr(self._client, 'aclose'):
+            await self._client.aclose()
+        else:
+            await self._client.close()
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.terminate()
+            await self._proc.wait()
+        self._proc = None
@@ -0,0 +1,27 @@
+"""Runs cloudconvert_worker.main with download, convert and upload replaced by short sleeps,
+so the coordinator tests can start real worker processes without rclone or HandBrake.
+Usage: fake_worker.py host port tmpdir name [seconds per stage]"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cloudconvert  # noqa: E402
+import cloudconvert_worker  # noqa: E402
+
+
+def fake_stage(flag: str, seconds: float):
+    async def stage(job: cloudconvert.Job, on_progress=None) -> None:
+        await asyncio.sleep(seconds)
+        setattr(job, flag, True)
+    return stage
+
+
+if __name__ == '__main__':
+    host, port, temppath, name = sys.argv[1:5]
+    seconds = float(sys.argv[5]) if len(sys.argv) > 5 else 0.5
+    cloudconvert.Job.download = fake_stage('is_downloaded', seconds)
+    cloudconvert.Job.convert = fake_stage('is_converted', seconds)
+    cloudconvert.Job.upload = fake_stage('is_uploaded', seconds)
+    asyncio.run(cloudconvert_worker.main(host, port, Path(temppath), name))
@@ -0,0 +1,116 @@
+"""Runs small shell commands through asyncrun, under asyncio and under trio."""
+import asyncio
+import gc
+import subprocess
+import time
+
+import pytest
+import trio
+
+import asyncrun
+
+
+@pytest.fixture
+def profiler():
+    asyncrun.profiler.enable()
+    asyncrun.profiler.reset()
+    yield asyncrun.profiler
+    asyncrun.profiler.disable()
+    asyncrun.profiler.reset()
+
+
+@pytest.fixture
+def limit():
+    original = asyncrun.max_concurrent
+    asyncrun.set_concurrency_limit(2)
+    yield 2
+    asyncrun.set_concurrency_limit(original)
+
+
+async def output_and_errors() -> None:
+    assert await asyncrun.asyncrun('echo', 'hello', 42) == "hello 42\n"
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        await asyncrun.asyncrun('sh', '-c', 'echo broken >&2; exit 3')
+    assert error.value.returncode == 3 and b'broken' in error.value.stderr
+    assert [line async for line in asyncrun.asyncrun_lines('printf', 'a\\nb\\rc', separators=b'\r\n')] == \
+        ['a', 'b', 'c']
+
+
+async def timeouts() -> None:
+    started = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        await asyncrun.asyncrun('sleep', 10, timeout=0.2)
+    with pytest.raises(subprocess.TimeoutExpired):
+        async for _ in asyncrun.asyncrun_stream('sleep', 10, timeout=0.2):
+            pass
+    assert time.monotonic() - started < 5  # Both got killed instead of waited for.
+
+
+async def early_stop() -> None:
+    started = time.monotonic()
+    lines = asyncrun.asyncrun_lines('sh', '-c', 'echo first; exec sleep 10')
+    assert await lines.__anext__() == 'first'
+    await lines.aclose()  # Kills the command.
+    assert asyncrun.profiler.running == 0
+    assert time.monotonic() - started < 5
+
+
+@pytest.mark.parametrize('test', [output_and_errors, timeouts, early_stop])
+def test_asyncio(test):
+    asyncio.run(test())
+
+
+@pytest.mark.parametrize('test', [output_and_errors, timeouts, early_stop])
+def test_trio(test):
+    trio.run(test)
+
+
+def test_limit_under_asyncio(profiler, limit: int):
+    async def run() -> None:
+        await asyncio.gather(*(asyncrun.asyncrun('sleep', 0.2) for _ in range(5)))
+
+    asyncio.run(run())
+    assert profiler.stats['sleep'].count == 5
+    assert profiler.stats['sleep'].max_concurrency == limit
+
+
+def test_limit_under_trio(profiler, limit: int):
+    async def run() -> None:
+        async with trio.open_nursery() as nursery:
+            for _ in range(5):
+                nursery.start_soon(asyncrun.asyncrun, 'sleep', 0.2)
+
+    trio.run(run)
+    assert profiler.stats['sleep'].count == 5
+    assert profiler.stats['sleep'].max_concurrency == limit
+
+
+def test_unlimited_streams_dont_count(profiler, limit: int):
+    async def run() -> float:
+        async def encode() -> None:
+            async for _ in asyncrun.asyncrun_stream('sleep', 2, limited=False):
+                pass
+
+        async def short() -> float:
+            await asyncio.sleep(0.2)  # The encodes are running by now.
+            await asyncrun.asyncrun('true')
+            return time.monotonic() - started
+
+        started = time.monotonic()
+        *_, finished = await asyncio.gather(*(encode() for _ in range(limit)), short())
+        return finished
+
+    assert asyncio.run(run()) < 1.5  # It didn't wait for the encodes to finish.
+    assert profiler.stats['true'].max_concurrency == limit + 1
+
+
+def test_limiter_per_loop():
+    async def limiter():
+        return asyncrun._limiter()[1]
+
+    first = asyncio.run(limiter())
+    second = asyncio.run(limiter())
+    assert first is not second
+    del first, second
+    gc.collect()
+    assert len(asyncrun._limiters) == 0  # They went away with their loops.
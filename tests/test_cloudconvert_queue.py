@@ -0,0 +1,61 @@
+"""Checks the order the scheduling policies of cloudconvert_queue hand out jobs in."""
+import asyncio
+from typing import List, Optional
+
+import pytest
+
+import rclone
+from cloudconvert import Job
+from cloudconvert_queue import FairFolders, JobQueue, Priorities, SchedulingPolicy, ShortestFirst
+
+
+def make_job(path: str, size: int, priority: int = 0) -> Job:
+    folder, name = path.rsplit('/', 1)
+    item = {'Path': name, 'Name': name, 'Size': size, 'MimeType': 'video/x-matroska'}
+    job = Job(rclone.RcloneFile(item, 'Drive', folder))
+    job.priority = priority
+    return job
+
+
+jobs = [make_job('Videos/A/1.mkv', 300), make_job('Videos/A/2.mkv', 100, priority=1),
+        make_job('Videos/A/3.mkv', 200), make_job('Videos/B/1.mkv', 400, priority=2),
+        make_job('Videos/B/2.mkv', 50)]
+
+
+def order(policy: Optional[SchedulingPolicy]) -> List[str]:
+    async def run() -> List[str]:
+        queue = JobQueue(policy)
+        for job in jobs:
+            queue.put_nowait(job)
+        assert [str(job.inputfile.fullpath) for job in queue.ordered()] == \
+            [str(job.inputfile.fullpath) for job in queue.ordered(0, len(jobs))]
+        started = []
+        while not queue.empty():
+            started.append(await queue.get())
+            queue.task_done()
+        return [str(job.inputfile.fullpath.relative_to('Drive:/Videos')) for job in started]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('policy, expected', [
+    (None, ['A/1.mkv', 'A/2.mkv', 'A/3.mkv', 'B/1.mkv', 'B/2.mkv']),
+    (ShortestFirst(), ['B/2.mkv', 'A/2.mkv', 'A/3.mkv', 'A/1.mkv', 'B/1.mkv']),
+    (FairFolders(), ['A/1.mkv', 'B/1.mkv', 'A/2.mkv', 'B/2.mkv', 'A/3.mkv']),
+    (Priorities(), ['B/1.mkv', 'A/2.mkv', 'A/1.mkv', 'A/3.mkv', 'B/2.mkv']),
+])
+def test_policies(policy: Optional[SchedulingPolicy], expected: List[str]):
+    assert order(policy) == expected
+
+
+def test_ordered_pages():
+    async def run() -> None:
+        queue = JobQueue(ShortestFirst())
+        for job in jobs:
+            queue.put_nowait(job)
+        everything = queue.ordered()
+        assert queue.ordered(1, 2) == everything[1:3]
+        assert queue.ordered(4, 10) == everything[4:]
+        assert queue.qsize() == len(jobs)  # Looking doesn't take anything out.
+
+    asyncio.run(run())
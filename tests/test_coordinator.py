@@ -0,0 +1,150 @@
+"""Tests the Coordinator with two worker processes on localhost, see fake_worker.py, and with hand-written messages."""
+import asyncio
+import json
+import signal
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+import cloudconvert_worker
+import rclone
+import video_convert
+from cloudconvert import Job, Pipeline
+from cloudconvert_coordinator import Coordinator
+
+worker_script = str(Path(__file__).resolve().parent / 'fake_worker.py')
+
+
+def make_job(number: int) -> Job:
+    item = {'Path': f"video{number}.mkv", 'Name': f"video{number}.mkv", 'Size': 1000, 'MimeType': 'video/x-matroska'}
+    return Job(rclone.RcloneFile(item, 'Drive', '/Videos'))
+
+
+async def start_worker(port: int, temppath: Path, name: str) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(sys.executable, worker_script, '127.0.0.1', str(port),
+                                                str(temppath / name), name)
+
+
+async def wait_for(condition, timeout: float = 30.0) -> None:
+    waited = 0.0
+    while not condition():
+        assert waited < timeout, "timed out"
+        await asyncio.sleep(0.05)
+        waited += 0.05
+
+
+async def run_workers(temppath: Path) -> None:
+    pipeline = Pipeline(1, 1, 1)
+    events = pipeline.events.subscribe()
+    coordinator = Coordinator(pipeline, lease_time=1.0, retry_in=0.1)
+    await coordinator.start(port=0)
+    jobs = [make_job(number) for number in range(4)]
+    for job in jobs:
+        await pipeline.put(job)
+    stalled = await start_worker(coordinator.port, temppath, 'stalled')
+    other = None
+    try:
+        await wait_for(lambda: any(lease.worker == 'stalled' for lease in coordinator.leases.values()))
+        stalled_lease = next(lease for lease in coordinator.leases.values() if lease.worker == 'stalled')
+        stalled.send_signal(signal.SIGSTOP)  # Keeps the connection open, but stops the heartbeats.
+        other = await start_worker(coordinator.port, temppath, 'other')
+        await asyncio.wait_for(pipeline.join(), 60)
+
+        assert coordinator.finished == len(jobs)
+        assert coordinator.failed == 0
+        assert stalled_lease.id not in coordinator.leases
+        assert all(job.is_downloaded and job.is_converted and job.is_uploaded for job in jobs)
+        # The expired lease can't report a result anymore, its job was finished by the other worker.
+        assert not coordinator.result(stalled_lease.id, True)
+
+        seen: List[Dict[str, Any]] = []
+        while not events.empty():
+            seen.append(events.get_nowait())
+        expired = [event for event in seen if event['event'] == 'failed' and 'expired' in event['reason']]
+        assert [event['worker'] for event in expired] == ['stalled']
+        path = expired[0]['path']
+        after = seen[seen.index(expired[0]) + 1:]
+        assert any(event['event'] == 'queued' and event['path'] == path for event in after)
+        assert any(event['event'] == 'finished' and event['path'] == path and event['worker'] == 'other'
+                   for event in after)
+    finally:
+        stalled.send_signal(signal.SIGCONT)
+        await coordinator.stop()
+        for process in (stalled, other):
+            if process is not None:
+                try:
+                    await asyncio.wait_for(process.wait(), 10)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+
+
+def test_lease_expiry_requeue_and_results(tmp_path: Path):
+    asyncio.run(run_workers(tmp_path))
+
+
+async def wrong_token(temppath: Path) -> int:
+    coordinator = Coordinator(Pipeline(1, 1, 1), token='secret')
+    await coordinator.start(port=0)
+    try:
+        worker = await start_worker(coordinator.port, temppath, 'intruder')
+        return await asyncio.wait_for(worker.wait(), 30)
+    finally:
+        await coordinator.stop()
+
+
+def test_wrong_token_gets_disconnected(tmp_path: Path):
+    # Without a token the worker would wait for jobs forever, it only stops because it got disconnected.
+    assert asyncio.run(wrong_token(tmp_path)) == 0
+
+
+async def malformed_heartbeats() -> None:
+    pipeline = Pipeline(1, 1, 1)
+    coordinator = Coordinator(pipeline)
+    await coordinator.start(port=0)
+    await pipeline.put(make_job(0))
+    reader, writer = await asyncio.open_connection('127.0.0.1', coordinator.port)
+
+    async def send(message: Any) -> Dict[str, Any]:
+        writer.write(json.dumps(message).encode() + b'\n')
+        await writer.drain()
+        return json.loads(await reader.readline())
+
+    try:
+        lease = (await send({'op': 'lease', 'worker': 'test'}))['lease']
+        job = coordinator.leases[lease].job
+        # A newer worker sending a field this version doesn't know.
+        progress = {'task': 1, 'tasks': 1, 'percent': 12.5, 'fps': 30.0, 'bitrate': 1000}
+        assert await send({'op': 'heartbeat', 'lease': lease, 'state': {'progress': progress}}) == {'ok': True}
+        assert job.progress == video_convert.Progress(1, 1, 12.5, 30.0)
+        # Missing fields, or no dict at all, only lose the progress.
+        for progress in ({'fps': 30.0}, [1, 1, 50.0], 'half'):
+            assert await send({'op': 'heartbeat', 'lease': lease, 'state': {'progress': progress}}) == {'ok': True}
+        assert job.progress == video_convert.Progress(1, 1, 12.5, 30.0)
+        assert 'error' in await send({'op': 'heartbeat'})
+        assert lease in coordinator.leases  # The connection stays up and keeps its lease.
+        assert await send({'op': 'result', 'lease': lease, 'ok': True}) == {'ok': True}
+    finally:
+        writer.close()
+        await coordinator.stop()
+
+
+def test_malformed_heartbeats():
+    asyncio.run(malformed_heartbeats())
+
+
+def test_worker_survives_rejected_heartbeats():
+    job = make_job(0)
+    stages = []
+
+    async def stage(*args, **kwargs) -> None:
+        await asyncio.sleep(0.1)
+        stages.append(True)
+
+    job.download = job.convert = job.upload = job.cleanup = stage
+
+    async def request(message: Dict[str, Any]) -> Dict[str, Any]:
+        raise cloudconvert_worker.ProtocolError("Bad request")
+
+    assert asyncio.run(cloudconvert_worker.run_leased(job, '1', 0.1, request)) == (True, None)
+    assert len(stages) == 4
@@ -0,0 +1,33 @@
+"""Feeds rclone.decode_stream JSON arrays in chunks of every size, the way rclone's output arrives."""
+import asyncio
+import json
+from typing import Any, AsyncIterator, List
+
+import pytest
+
+import rclone
+
+ARRAYS = [b'[12345, 6]', b'[1,true,null,-2.5e3,"a\\"b",{"x":[1,22]},[333]]', b'[]', b'[ 7 ]',
+          '[\n{"Name":"ä"},\n{"Name":"b"}\n]\n'.encode()]
+
+
+def decode(data: bytes, size: int) -> List[Any]:
+    async def chunks() -> AsyncIterator[bytes]:
+        for start in range(0, len(data), size):
+            yield data[start:start + size]
+
+    async def collect() -> List[Any]:
+        return [element async for element in rclone.decode_stream(chunks())]
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize('data', ARRAYS)
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 100])
+def test_chunked(data: bytes, size: int):
+    assert decode(data, size) == json.loads(data)
+
+
+def test_truncated():
+    with pytest.raises(ValueError):
+        decode(b'[12', 1)
@@ -0,0 +1,55 @@
+"""Sorts a small generated Downloads folder with download_sort."""
+import asyncio
+import os
+from pathlib import Path
+from typing import List
+
+import pytest
+
+pytest.importorskip('PySimpleGUI')  # Imported by GUI, which download_sort needs for its windows.
+pytest.importorskip('aiofiles')
+import download_sort  # noqa: E402
+
+
+@pytest.fixture
+def downloads(tmp_path: Path) -> Path:
+    folder = Path(tmp_path, 'Downloads')
+    for name in ('a.pdf', 'sub/b.mp4', 'sub/deeper/c.png', 'sub/deeper/notes', '.hidden.pdf', '.cache/d.pdf',
+                 'Dokumente/sorted.pdf'):
+        Path(folder, name).parent.mkdir(parents=True, exist_ok=True)
+        Path(folder, name).write_text(name)
+    outside = Path(tmp_path, 'outside')
+    outside.mkdir()
+    Path(outside, 'e.pdf').write_text('e')
+    os.symlink(outside, Path(folder, 'linked'))
+    return folder
+
+
+def test_walk_files(downloads: Path):
+    found = sorted(str(file.relative_to(downloads)) for file in download_sort.walk_files(downloads))
+    assert found == ['Dokumente/sorted.pdf', 'a.pdf', 'sub/b.mp4', 'sub/deeper/c.png', 'sub/deeper/notes']
+
+
+def test_all_files_in_batches(downloads: Path, monkeypatch):
+    monkeypatch.setattr(download_sort, 'batch_size', 2)
+
+    async def collect(limit: int) -> List[Path]:
+        files = []
+        async for file in download_sort.all_files(downloads):
+            files.append(file)
+            if len(files) == limit:
+                break  # Stops the walker thread early.
+        return files
+
+    assert sorted(asyncio.run(collect(100))) == sorted(download_sort.walk_files(downloads))
+    assert len(asyncio.run(collect(1))) == 1
+
+
+def test_sort(downloads: Path, monkeypatch):
+    monkeypatch.chdir(downloads.parent)  # A relative path, like from the command line.
+    asyncio.run(download_sort.main('Downloads'))
+    files = sorted(str(path.relative_to(downloads)) for path in downloads.rglob('*') if path.is_file())
+    # Files already in their folder stay as they are, hidden ones and unknown types where they were.
+    assert files == ['.cache/d.pdf', '.hidden.pdf', 'Bilder/c.png', 'Dokumente/a.pdf', 'Dokumente/sorted.pdf',
+                     'Videos/b.mp4', 'sub/deeper/notes']
+    assert Path(downloads.parent, 'outside', 'e.pdf').exists()
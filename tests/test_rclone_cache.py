@@ -0,0 +1,191 @@
+"""Tests the CommandCache of rclone_cache with fetches that count how often they ran."""
+import asyncio
+from typing import AsyncIterator, List
+
+import pytest
+import trio
+
+from rclone_cache import CommandCache, normalize, overlaps
+
+
+class Fetch:
+    """A fetch that takes a while and counts how often it was started."""
+
+    def __init__(self, value, delay: float = 0.05):
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+
+def test_normalize_and_overlaps():
+    assert normalize('Drive:/Videos/') == normalize('Drive:Videos') == 'Drive:Videos'
+    assert normalize('Drive:/') == normalize('Drive:') == 'Drive:'
+    assert overlaps('Drive:Videos', 'Drive:Videos/a.mkv')
+    assert overlaps('Drive:', 'Drive:Videos')
+    assert not overlaps('Drive:Videos', 'Drive:Videos2')
+
+
+def test_single_flight():
+    cache = CommandCache()
+    fetch = Fetch(['a.mkv'])
+
+    async def run() -> None:
+        results = await asyncio.gather(*(cache.get(('lsjson', 'Drive:'), ['Drive:'], fetch) for _ in range(10)))
+        assert all(result == ['a.mkv'] for result in results)
+
+    asyncio.run(run())
+    assert fetch.calls == 1
+    assert (cache.misses, cache.hits) == (1, 9)
+
+
+def test_single_flight_under_trio():
+    cache = CommandCache()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await trio.sleep(0.05)
+        return 42
+
+    async def run() -> None:
+        async with trio.open_nursery() as nursery:
+            for _ in range(5):
+                nursery.start_soon(cache.get, ('size', 'Drive:'), ['Drive:'], fetch)
+
+    trio.run(run)
+    assert calls == 1
+
+
+def test_errors_are_shared_but_not_cached():
+    cache = CommandCache()
+    fetch = Fetch(RuntimeError("rclone failed"))
+
+    async def run() -> None:
+        results = await asyncio.gather(*(cache.get(('size', 'Drive:'), ['Drive:'], fetch) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert fetch.calls == 1
+        fetch.value = 7
+        assert await cache.get(('size', 'Drive:'), ['Drive:'], fetch) == 7
+
+    asyncio.run(run())
+
+
+def test_cancelled_fetch_is_taken_over():
+    cache = CommandCache()
+    fetch = Fetch('listing', delay=0.2)
+
+    async def run() -> None:
+        first = asyncio.ensure_future(cache.get(('lsjson', 'Drive:'), ['Drive:'], fetch))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(cache.get(('lsjson', 'Drive:'), ['Drive:'], fetch))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        assert await second == 'listing'
+
+    asyncio.run(run())
+    assert fetch.calls == 2
+
+
+def test_ttl_and_lru(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('rclone_cache.time.monotonic', lambda: now[0])
+    cache = CommandCache(ttl=10, max_entries=2)
+
+    async def get(key: str, fetch: Fetch):
+        return await cache.get((key,), ['Drive:' + key], fetch)
+
+    async def run() -> None:
+        fetches = {key: Fetch(key, delay=0) for key in 'abc'}
+        await get('a', fetches['a'])
+        await get('b', fetches['b'])
+        await get('a', fetches['a'])  # Now b is the least recently used one.
+        await get('c', fetches['c'])
+        await get('b', fetches['b'])
+        assert (fetches['a'].calls, fetches['b'].calls, fetches['c'].calls) == (1, 2, 1)
+        now[0] += 11
+        await get('c', fetches['c'])
+        assert fetches['c'].calls == 2
+
+    asyncio.run(run())
+
+
+def test_invalidate():
+    cache = CommandCache()
+
+    async def run() -> None:
+        below = Fetch('below', delay=0)
+        beside = Fetch('beside', delay=0)
+        await cache.get(('lsjson', 'Drive:Videos/Show'), ['Drive:Videos/Show'], below)
+        await cache.get(('lsjson', 'Drive:Music'), ['Drive:Music'], beside)
+        cache.invalidate('Drive:/Videos/')
+        await cache.get(('lsjson', 'Drive:Videos/Show'), ['Drive:Videos/Show'], below)
+        await cache.get(('lsjson', 'Drive:Music'), ['Drive:Music'], beside)
+        assert (below.calls, beside.calls) == (2, 1)
+
+        # A result that was still being fetched when its path changed isn't kept.
+        slow = Fetch('old', delay=0.1)
+        running = asyncio.ensure_future(cache.get(('lsjson', 'Drive:Videos'), ['Drive:Videos'], slow))
+        await asyncio.sleep(0.02)
+        cache.invalidate('Drive:Videos/new.mkv')
+        assert await running == 'old'
+        slow.value = 'new'
+        assert await cache.get(('lsjson', 'Drive:Videos'), ['Drive:Videos'], slow) == 'new'
+
+    asyncio.run(run())
+
+
+def test_stream():
+    cache = CommandCache()
+    calls = 0
+
+    async def fetch() -> AsyncIterator[int]:
+        nonlocal calls
+        calls += 1
+        for number in range(3):
+            await asyncio.sleep(0.01)
+            yield number
+
+    async def collect() -> List[int]:
+        return [piece async for piece in cache.stream(('lsjson', 'Drive:'), ['Drive:'], fetch)]
+
+    async def run() -> None:
+        assert await asyncio.gather(collect(), collect()) == [[0, 1, 2], [0, 1, 2]]
+        assert await collect() == [0, 1, 2]
+
+    asyncio.run(run())
+    assert calls == 1
+
+
+def test_disabled():
+    cache = CommandCache()
+    cache.enabled = False
+    fetch = Fetch(1, delay=0)
+
+    async def run() -> None:
+        for _ in range(3):
+            await cache.get(('size', 'Drive:'), ['Drive:'], fetch)
+
+    asyncio.run(run())
+    assert fetch.calls == 3
+
+
+@pytest.mark.parametrize('path', ['Drive:Videos', 'Drive:/Videos', 'Drive:/Videos/'])
+def test_spellings_share_entries(path: str):
+    cache = CommandCache()
+    fetch = Fetch('listing', delay=0)
+
+    async def run() -> None:
+        await cache.get(('lsjson', normalize('Drive:Videos')), ['Drive:Videos'], fetch)
+        await cache.get(('lsjson', normalize(path)), [path], fetch)
+
+    asyncio.run(run())
+    assert fetch.calls == 1
@@ -0,0 +1,59 @@
+"""Runs rclone_diff.diff on trees built from lsjson entries that already carry their hashes, so rclone isn't needed."""
+import asyncio
+from typing import List, Tuple
+
+import rclone
+import rclone_diff
+from rclone_diff import ChangeType
+
+Entry = Tuple[str, int, str, str]  # Path, size, modtime, md5
+
+source_entries: List[Entry] = [
+    ('same.mkv', 100, '2020-01-01T00:00:00Z', 'aaa'),
+    ('bigger.mkv', 200, '2020-01-01T00:00:00Z', 'bbb'),
+    ('touched.mkv', 300, '2020-02-01T00:00:00Z', 'ccc'),  # Only the modtime differs.
+    ('edited.mkv', 400, '2020-02-01T00:00:00Z', 'ddd'),  # Same size, other content.
+    ('Show/renamed.mkv', 500, '2020-01-01T00:00:00Z', 'eee'),
+    ('new.mkv', 600, '2020-01-01T00:00:00Z', 'fff'),
+    ('lookalike.mkv', 700, '2020-01-01T00:00:00Z', 'ggg'),  # Same size as a deleted file, but other content.
+]
+destination_entries: List[Entry] = [
+    ('same.mkv', 100, '2020-01-01T00:00:00.4Z', 'aaa'),
+    ('bigger.mkv', 150, '2020-01-01T00:00:00Z', 'bbb'),
+    ('touched.mkv', 300, '2020-01-01T00:00:00Z', 'ccc'),
+    ('edited.mkv', 400, '2020-01-01T00:00:00Z', 'xxx'),
+    ('Old/renamed.mkv', 500, '2020-01-01T00:00:00Z', 'eee'),
+    ('gone.mkv', 700, '2020-01-01T00:00:00Z', 'hhh'),
+]
+
+
+def tree(drive: str, entries: List[Entry]) -> rclone.RcloneDirectory:
+    items = []
+    for folder in sorted({path.rsplit('/', 1)[0] for path, *_ in entries if '/' in path}):
+        items.append({'Path': folder, 'Name': folder, 'Size': -1, 'MimeType': 'inode/directory', 'IsDir': True})
+    for path, size, modtime, md5 in entries:
+        items.append({'Path': path, 'Name': path.rsplit('/', 1)[-1], 'Size': size, 'MimeType': 'video/x-matroska',
+                      'IsDir': False, 'ModTime': modtime, 'Hashes': {'md5': md5}})
+    root = rclone.directory_at(drive, 'Videos')
+    return rclone.attach(root, (rclone.make_item(item, drive + ':', 'Videos') for item in items))
+
+
+def plan(detect_moves: bool = True) -> rclone_diff.SyncPlan:
+    return asyncio.run(rclone_diff.diff(tree('Source', source_entries), tree('Destination', destination_entries),
+                                        detect_moves=detect_moves))
+
+
+def test_diff():
+    result = plan()
+    assert {change.path: change.type for change in result.changes} == {
+        'bigger.mkv': ChangeType.CHANGED, 'edited.mkv': ChangeType.CHANGED, 'Show/renamed.mkv': ChangeType.MOVED,
+        'new.mkv': ChangeType.NEW, 'lookalike.mkv': ChangeType.NEW, 'gone.mkv': ChangeType.DELETED}
+    moved, = result.of_type(ChangeType.MOVED)
+    assert moved.old_path == 'Old/renamed.mkv'
+
+
+def test_diff_without_moves():
+    changes = {change.path: change.type for change in plan(detect_moves=False).changes}
+    assert changes['Show/renamed.mkv'] is ChangeType.NEW
+    assert changes['Old/renamed.mkv'] is ChangeType.DELETED
+    assert ChangeType.MOVED not in changes.values()
@@ -0,0 +1,19 @@
+"""Builds an RcloneListing from lsjson entries and reads the items back out of its columns."""
+import rclone
+
+
+def test_items_round_trip():
+    listing = rclone.RcloneListing('Drive', 'Videos')
+    entries = [{'Path': 'Show', 'Name': 'Show', 'Size': -1, 'MimeType': 'inode/directory', 'IsDir': True},
+               {'Path': 'Show/a.mkv', 'Name': 'a.mkv', 'Size': 1000, 'MimeType': 'video/x-matroska', 'IsDir': False,
+                'ModTime': '2019-12-24T18:00:00.123456789+01:00'},
+               {'Path': 'b.mp4', 'Name': 'b.mp4', 'Size': 2000, 'MimeType': 'video/mp4', 'IsDir': False}]
+    for entry in entries:
+        listing.append(entry)
+    folder, first, second = listing
+    assert isinstance(folder, rclone.RcloneDirectory)
+    assert str(first.fullpath) == 'Drive:/Videos/Show/a.mkv'
+    assert (first.name, first._size, first.filetype) == ('a.mkv', 1000, 'video/x-matroska')
+    assert abs(first.modtime - rclone.parse_modtime(entries[1]['ModTime'])) < 1e-6
+    assert second.modtime is None
+    assert listing.total_size() == 3000
@@ -0,0 +1,81 @@
+"""Tests RcloneRC against a small stand-in HTTP server, and the rc backend of rclone.py against a real
+rclone rcd with a local folder, when rclone is installed."""
+import asyncio
+import shutil
+import socket
+from pathlib import Path
+from typing import Tuple
+
+import pytest
+
+import rclone
+from rclone_rc import RcloneRC, RcloneRCError
+
+# The stand-in server's answers for every command: status, content type, body.
+answers = {'rc/noop': (200, 'application/json', '{}'),
+           'operations/size': (200, 'application/json', '{"count": 2, "bytes": 300}'),
+           'operations/stat': (404, 'application/json', '{"error": "object not found", "status": 404}'),
+           'operations/list': (502, 'text/html', '<html><body>Bad Gateway</body></html>')}
+
+
+async def answer(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    request = await reader.readuntil(b'\r\n\r\n')
+    command = request.split(b' ')[1].decode().lstrip('/')
+    length = next((int(line.split(b':')[1]) for line in request.split(b'\r\n')
+                   if line.lower().startswith(b'content-length:')), 0)
+    await reader.readexactly(length)
+    status, content_type, body = answers[command]
+    writer.write(f"HTTP/1.1 {status} X\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                 f"Connection: close\r\n\r\n{body}".encode())
+    await writer.drain()
+    writer.close()
+
+
+async def stand_in() -> Tuple[asyncio.AbstractServer, str]:
+    server = await asyncio.start_server(answer, '127.0.0.1', 0)
+    return server, f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+
+def test_calls_and_errors():
+    async def run() -> None:
+        server, addr = await stand_in()
+        backend = RcloneRC(addr)
+        try:
+            await backend.start()  # Finds the stand-in already answering and doesn't start rclone.
+            assert await backend.call('operations/size', fs='/tmp') == {'count': 2, 'bytes': 300}
+            with pytest.raises(RcloneRCError) as error:
+                await backend.call('operations/stat', fs='/tmp', remote='missing')
+            assert error.value.status == 404 and error.value.error == 'object not found'
+            with pytest.raises(RcloneRCError) as error:
+                await backend.call('operations/list', fs='/tmp', remote='')
+            assert error.value.status == 502 and 'Bad Gateway' in error.value.error
+        finally:
+            await backend.close()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(shutil.which('rclone') is None, reason="needs rclone")
+def test_rcd_with_local_folder(tmp_path: Path):
+    Path(tmp_path, 'a.mkv').write_bytes(b'a' * 100)
+    Path(tmp_path, 'sub').mkdir()
+    Path(tmp_path, 'sub', 'b.mkv').write_bytes(b'b' * 200)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    async def run() -> None:
+        await rclone.use_rc(f"127.0.0.1:{port}")
+        try:
+            result = await rclone.rc.call('operations/list', fs=str(tmp_path), remote='', opt={'recurse': True})
+            assert sorted(item['Path'] for item in result['list']) == ['a.mkv', 'sub', 'sub/b.mkv']
+            size = await rclone.rc.call('operations/size', fs=str(tmp_path))
+            assert (size['count'], size['bytes']) == (2, 300)
+            with pytest.raises(RcloneRCError):
+                await rclone.rc.call('operations/list', fs=str(tmp_path / 'missing'), remote='')
+        finally:
+            await rclone.use_subprocess()
+
+    asyncio.run(run())
@@ -0,0 +1,19 @@
+"""rclone.relative_to, which copy_files, move_files and delete_files use to build their --files-from-raw lists."""
+import pytest
+
+from rclone import relative_to
+
+
+@pytest.mark.parametrize('folder', ['Drive:Videos', 'Drive:/Videos', 'Drive:/Videos/', 'Drive:Videos/'])
+def test_spellings(folder: str):
+    assert relative_to('Drive:/Videos/Show/a.mkv', folder) == 'Show/a.mkv'
+
+
+def test_drive_root():
+    assert relative_to('Drive:/Videos/a.mkv', 'Drive:') == 'Videos/a.mkv'
+
+
+@pytest.mark.parametrize('folder', ['Drive:Vid', 'Other:Videos', 'Drive:Videos/a.mkv'])
+def test_not_below(folder: str):
+    with pytest.raises(ValueError):
+        relative_to('Drive:/Videos/a.mkv', folder)
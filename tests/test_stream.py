@@ -0,0 +1,69 @@
+"""Reads files through StreamMount from rclone's local backend, behind an alias remote set up in the environment.
+Needs rclone and FUSE, the encode test HandBrakeCLI and ffmpeg as well."""
+import asyncio
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import rclone
+import video_convert
+from cloudconvert_stream import StreamMount
+
+pytestmark = pytest.mark.skipif(shutil.which('rclone') is None or not os.path.exists('/dev/fuse'),
+                                reason="needs rclone and FUSE")
+
+
+@pytest.fixture
+def remote(tmp_path: Path, monkeypatch) -> Path:
+    folder = Path(tmp_path, 'remote')
+    folder.mkdir()
+    monkeypatch.setenv('RCLONE_CONFIG_STREAMTEST_TYPE', 'alias')
+    monkeypatch.setenv('RCLONE_CONFIG_STREAMTEST_REMOTE', str(folder))
+    return folder
+
+
+def remote_file(name: str, size: int) -> rclone.RcloneFile:
+    return rclone.RcloneFile({'Path': name, 'Name': name, 'Size': size, 'MimeType': 'video/mp2t'}, 'streamtest', '/')
+
+
+def test_reads_and_seeks(remote: Path):
+    data = os.urandom(3 * 1024 * 1024)
+    Path(remote, 'clip.ts').write_bytes(data)
+
+    async def read() -> None:
+        mount = StreamMount()
+        try:
+            path = await mount.path(remote_file('clip.ts', len(data)))
+            assert path.stat().st_size == len(data)
+            with open(path, 'rb') as file:
+                file.seek(2 * 1024 * 1024)
+                assert file.read(4096) == data[2 * 1024 * 1024:2 * 1024 * 1024 + 4096]
+                file.seek(0)
+                assert file.read() == data
+        finally:
+            await mount.close()
+
+    asyncio.run(read())
+
+
+@pytest.mark.skipif(shutil.which('HandBrakeCLI') is None or shutil.which('ffmpeg') is None,
+                    reason="needs HandBrakeCLI and ffmpeg")
+def test_handbrake_encodes_from_mount(remote: Path, tmp_path: Path):
+    clip = Path(remote, 'clip.ts')
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc2=size=320x240:rate=25:duration=3',
+                    '-c:v', 'mpeg2video', str(clip)], check=True)
+    output = Path(tmp_path, 'clip.mp4')
+
+    async def encode() -> None:
+        mount = StreamMount()
+        try:
+            source = await mount.path(remote_file('clip.ts', clip.stat().st_size))
+            await video_convert.convert(source, output)
+        finally:
+            await mount.close()
+
+    asyncio.run(encode())
+    assert output.stat().st_size > 0
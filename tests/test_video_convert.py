@@ -0,0 +1,51 @@
+"""Parses HandBrakeCLI progress output, from single lines and from a stand-in HandBrakeCLI."""
+import asyncio
+import os
+import stat
+from pathlib import Path
+
+import video_convert
+from video_convert import Progress, parse_progress
+
+# Stdout of HandBrakeCLI in the format it uses for a two pass encode, lines end in \r while a task runs.
+sample_output = (
+    "Encoding: task 1 of 2, 0.00 %\r"
+    "Encoding: task 1 of 2, 1.52 %\r"
+    "Encoding: task 1 of 2, 37.03 % (112.58 fps, avg 109.40 fps, ETA 00h00m11s)\r"
+    "Encoding: task 1 of 2, 99.99 % (98.01 fps, avg 104.22 fps, ETA 00h00m00s)\r\n"
+    "Encoding: task 2 of 2, 12.50 % (45.67 fps, avg 50.12 fps, ETA 01h02m03s)\r"
+    "\n"
+    "Encode done!\n"
+)
+
+
+def test_parse_progress():
+    assert parse_progress("Encoding: task 1 of 1, 12.34 %") == Progress(1, 1, 12.34)
+    assert parse_progress("Encoding: task 2 of 2, 12.50 % (45.67 fps, avg 50.12 fps, ETA 01h02m03s)") == \
+        Progress(2, 2, 12.5, 45.67, 50.12, 3723)
+    for line in ("", "Encode done!", "[12:00:01] libhb: work result = 0", "Muxing: this may take awhile..."):
+        assert parse_progress(line) is None
+
+
+def test_progress_from_handbrake(tmp_path: Path, monkeypatch):
+    Path(tmp_path, 'output').write_bytes(sample_output.encode())
+    script = Path(tmp_path, 'HandBrakeCLI')
+    script.write_text(f"#!/bin/sh\ncat '{tmp_path / 'output'}'\n")
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    async def collect():
+        return [event async for event in video_convert.progress('in.mkv', 'out.mp4')]
+
+    events = asyncio.run(collect())
+    assert [(event.task, event.percent) for event in events] == \
+        [(1, 0.0), (1, 1.52), (1, 37.03), (1, 99.99), (2, 12.5)]
+    assert events[2] == Progress(1, 2, 37.03, 112.58, 109.4, 11)
+
+
+def test_combine():
+    parts = [Progress(1, 1, 50.0, 20.0), None, Progress(1, 1, 100.0, 10.0)]
+    combined = video_convert.combine(parts, elapsed=60.0)
+    assert combined.percent == 50.0
+    assert combined.fps == 30.0
+    assert combined.eta == 60
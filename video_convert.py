@@ -1,21 +1,444 @@
+import argparse
 import asyncio
+import collections
+import json
+import os
 import pathlib
+import re
+import socket
 import sys
+import tempfile
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, NamedTuple, Optional
 
-from asyncrun import asyncrun_quiet
+from asyncrun import asyncrun_lines, asyncrun_quiet
 
+encoder_threads = 8  # Roughly how many cores one HandBrakeCLI run keeps busy.
 
-async def convert(input, output, preset='Fast 1080p30', quality="22.0", speed="slow"):
-    if isinstance(input, pathlib.Path):
-        input = str(input)
-    if isinstance(output, pathlib.Path):
-        output = str(output)
-    await asyncrun_quiet('HandBrakeCLI', '-i', input, '-o', output, '-O',
-                   '-Z', preset, '--quality', quality, '--encoder-preset', speed)
+# HandBrakeCLI rewrites a line like "Encoding: task 1 of 1, 12.34 % (45.67 fps, avg 50.12 fps, ETA 00h12m34s)"
+# on stdout, the part in parentheses only shows up after the first few seconds.
+progress_pattern = re.compile(r'Encoding: task (\d+) of (\d+), ([\d.]+) %'
+                              r'(?: \(([\d.]+) fps, avg ([\d.]+) fps, ETA (\d+)h(\d+)m(\d+)s\))?')
+
+
+class Progress(NamedTuple):
+    """How far an encode got, eta is in seconds."""
+    task: int
+    tasks: int
+    percent: float
+    fps: Optional[float] = None
+    avg_fps: Optional[float] = None
+    eta: Optional[int] = None
+
+
+class EncodeStats(NamedTuple):
+    """How one finished encode went. input_bytes is None for inputs that were streamed from a URL."""
+    input: str
+    preset: str
+    seconds: float
+    avg_fps: Optional[float]
+    input_bytes: Optional[int]
+    output_bytes: int
+
+    @property
+    def bytes_per_second(self) -> Optional[float]:
+        if self.input_bytes is None or self.seconds <= 0:
+            return None
+        return self.input_bytes / self.seconds
+
+
+def parse_progress(line: str) -> Optional[Progress]:
+    match = progress_pattern.search(line)
+    if match is None:
+        return None
+    task, tasks, percent, fps, avg_fps, hours, minutes, seconds = match.groups()
+    if fps is None:
+        return Progress(int(task), int(tasks), float(percent))
+    return Progress(int(task), int(tasks), float(percent), float(fps), float(avg_fps),
+                    int(hours) * 3600 + int(minutes) * 60 + int(seconds))
+
+
+async def progress(input, output, preset='Fast 1080p30', quality="22.0", speed="slow",
+                   *extra_args: str, preset_file: Optional[str] = None) -> AsyncIterator[Progress]:
+    """Runs the encode and yields its progress as HandBrakeCLI reports it, a few times per second.
+    :param extra_args Passed on to HandBrakeCLI as they are.
+    :param preset_file A preset file exported from HandBrake, like Videoh265.json, that defines preset.
+    :raises subprocess.CalledProcessError if HandBrakeCLI fails."""
+    imports = ['--preset-import-file', str(preset_file)] if preset_file else []
+    # Encodes can take hours, so they don't take a slot of the limit meant for short commands like rclone's.
+    async for line in asyncrun_lines('HandBrakeCLI', '-i', str(input), '-o', str(output), '-O', *imports,
+                                     '-Z', preset, '--quality', quality, '--encoder-preset', speed, *extra_args,
+                                     separators=b'\r\n', limited=False):
+        event = parse_progress(line)
+        if event is not None:
+            yield event
+
+
+async def convert(input, output, preset='Fast 1080p30', quality="22.0", speed="slow",
+                  on_progress: Optional[Callable[[Progress], None]] = None,
+                  preset_file: Optional[str] = None) -> EncodeStats:
+    """Encodes input, a path or an URL, to output.
+    :param on_progress Called with every progress update.
+    :returns How long the encode took and how fast it was."""
+    started = time.monotonic()
+    last: Optional[Progress] = None
+    async for event in progress(input, output, preset, quality, speed, preset_file=preset_file):
+        last = event
+        if on_progress is not None:
+            on_progress(event)
+    input_bytes = os.path.getsize(input) if os.path.exists(str(input)) else None
+    return EncodeStats(str(input), preset, time.monotonic() - started, last.avg_fps if last else None,
+                       input_bytes, os.path.getsize(output))
+
+
+async def duration(input) -> float:
+    """The length of the input in seconds, according to ffprobe."""
+    output = await asyncrun_quiet('ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                                  '-of', 'default=noprint_wrappers=1:nokey=1', str(input))
+    return float(output)
+
+
+async def autocrop(input) -> str:
+    """The crop HandBrake picks for the whole input, as top:bottom:left:right for --crop."""
+    output = await asyncrun_quiet('HandBrakeCLI', '--json', '--scan', '-i', str(input))
+    _, _, titles = output.partition('JSON Title Set:')
+    data, _ = json.JSONDecoder().raw_decode(titles.lstrip())
+    return ':'.join(str(side) for side in data['TitleList'][0]['Crop'])
+
+
+async def split(input, folder: pathlib.Path, segments: int) -> List[pathlib.Path]:
+    """Cuts the first video stream of the input into about equally long pieces without re-encoding,
+    so every piece starts at a keyframe. The audio is left out, concat adds it back in one piece."""
+    length = await duration(input)
+    await asyncrun_quiet('ffmpeg', '-v', 'error', '-i', str(input), '-map', '0:v:0', '-c', 'copy',
+                         '-f', 'segment', '-segment_time', f"{length / segments:.3f}", '-reset_timestamps', '1',
+                         str(folder / 'segment%04d.mkv'))
+    return sorted(folder.glob('segment*.mkv'))
+
+
+async def concat(parts: List[pathlib.Path], output, audio=None) -> None:
+    """Joins the encoded pieces without re-encoding them.
+    :param audio Where the first audio track gets taken from, it is encoded in one go
+    like HandBrake's presets do, to AAC stereo at 160 kbit/s, so there are no gaps at the cuts."""
+    listing = parts[0].parent / 'segments.txt'
+    listing.write_text("".join(f"file '{part.name}'\n" for part in parts))
+    sound = ['-map', '1:a:0?', '-c:a', 'aac', '-b:a', '160k', '-ac', '2'] if audio else []
+    await asyncrun_quiet('ffmpeg', '-v', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', str(listing),
+                         *(['-i', str(audio)] if audio else []), '-map', '0:v', '-c:v', 'copy', *sound,
+                         '-movflags', '+faststart', str(output))
+
+
+async def convert_segmented(input, output, preset='Fast 1080p30', quality="22.0", speed="slow",
+                            segments: Optional[int] = None, workers: Optional[int] = None,
+                            cores: Optional[int] = None, on_progress: Optional[Callable[[Progress], None]] = None,
+                            preset_file: Optional[str] = None) -> EncodeStats:
+    """Encodes input to output like convert, but splits it at keyframes and encodes the pieces at the same time,
+    which uses many cores much better than one HandBrakeCLI run on a slow encoder preset does.
+    Needs ffmpeg and ffprobe. The crop is detected once on the whole input, so all pieces get the same one,
+    and the audio is encoded separately in one piece when the pieces are joined.
+    :param cores How many cores this encode may use, by default all of them.
+    Callers that run several encodes at once should pass their share, so the pieces don't overload the host.
+    :param workers How many pieces get encoded at once, by default one for every encoder_threads of the cores.
+    :param segments How many pieces the input gets cut into, by default as many as there are workers.
+    :param on_progress Called with the combined progress, the fps are those of all pieces together."""
+    if cores is None:
+        cores = os.cpu_count() or 1
+    if workers is None:
+        workers = max(cores // encoder_threads, 1)
+    if segments is None:
+        segments = workers
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory(dir=pathlib.Path(output).parent) as folder:
+        crop = await autocrop(input)
+        parts = await split(input, pathlib.Path(folder), segments)
+        latest: List[Optional[Progress]] = [None] * len(parts)
+        limit = asyncio.Semaphore(workers)
+        threads = ['--encopts', f"threads={max(cores // workers, 1)}"]
+
+        async def encode(number: int, part: pathlib.Path) -> pathlib.Path:
+            encoded = part.with_suffix('.mp4')
+            async with limit:
+                async for event in progress(part, encoded, preset, quality, speed, '--crop', crop, *threads,
+                                            preset_file=preset_file):
+                    latest[number] = event
+                    if on_progress is not None:
+                        on_progress(combine(latest, time.monotonic() - started))
+            return encoded
+
+        encoded = await asyncio.gather(*(encode(number, part) for number, part in enumerate(parts)))
+        await concat(list(encoded), output, audio=input)
+    input_bytes = os.path.getsize(input) if os.path.exists(str(input)) else None
+    fps = [event.avg_fps for event in latest if event is not None and event.avg_fps is not None]
+    # Roughly the speed of all workers together.
+    avg_fps = sum(fps) / len(fps) * min(workers, len(latest)) if fps else None
+    return EncodeStats(str(input), preset, time.monotonic() - started, avg_fps, input_bytes, os.path.getsize(output))
+
+
+def combine(parts: List[Optional[Progress]], elapsed: float) -> Progress:
+    """Merges the progress of the pieces of a segmented encode into one."""
+    percent = sum(part.percent for part in parts if part is not None) / len(parts)
+    fps = sum(part.fps for part in parts if part is not None and part.fps is not None)
+    eta = int(elapsed * (100 - percent) / percent) if percent > 0 else None
+    return Progress(1, 1, percent, fps, None, eta)
+
+
+class Candidate(NamedTuple):
+    """Encoder settings calibrate can choose from."""
+    name: str
+    preset: str
+    quality: str
+    speed: str
+    preset_file: Optional[str] = None
+
+    def settings(self) -> Dict[str, Any]:
+        """The keyword arguments for convert and convert_segmented."""
+        return {'preset': self.preset, 'quality': self.quality, 'speed': self.speed, 'preset_file': self.preset_file}
+
+
+preset_folder = pathlib.Path(__file__).parent
+# Slowest, so smallest for the same quality, first.
+candidates = [Candidate('h265 slow', 'Videoh265', '29', 'slow', str(preset_folder / 'Videoh265.json')),
+              Candidate('h264 slow', 'Fast 1080p30', '22.0', 'slow'),
+              Candidate('h264 medium', 'Fast 1080p30', '22.0', 'medium'),
+              Candidate('h264 fast', 'Fast 1080p30', '22.0', 'fast'),
+              Candidate('h264 veryfast', 'Fast 1080p30', '22.0', 'veryfast')]
+calibration_file = pathlib.Path.cwd() / 'calibration.json'
+_calibrating: Dict[str, asyncio.Lock] = {}
+
+
+class SourceInfo(NamedTuple):
+    codec: str
+    width: int
+    height: int
+    fps: float
+    duration: float
+
+
+async def probe(input) -> SourceInfo:
+    """Reads the codec, resolution and frame rate of the first video stream with ffprobe."""
+    output = await asyncrun_quiet('ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                                  'stream=codec_name,width,height,avg_frame_rate:format=duration', '-of', 'json',
+                                  str(input))
+    data = json.loads(output)
+    stream = data['streams'][0]
+    numerator, _, denominator = stream.get('avg_frame_rate', '0/1').partition('/')
+    fps = float(numerator) / float(denominator or 1) if float(denominator or 1) else 0.0
+    return SourceInfo(stream['codec_name'], int(stream['width']), int(stream['height']), fps or 25.0,
+                      float(data['format'].get('duration', 0)))
+
+
+async def sample(input, candidate: Candidate, start: float, length: float, source: SourceInfo,
+                 folder: pathlib.Path) -> float:
+    """Encodes length seconds of the input from start on with the candidate.
+    HandBrakeCLI only takes whole seconds, so length gets rounded, to at least one second.
+    :returns The encode speed in fps."""
+    output = folder / f"sample {candidate.name} {start:.0f}.mp4"
+    seconds = max(round(length), 1)
+    started = time.monotonic()
+    last: Optional[Progress] = None
+    async for event in progress(input, output, candidate.preset, candidate.quality, candidate.speed,
+                                '--start-at', f"seconds:{start:.0f}", '--stop-at', f"seconds:{seconds}",
+                                preset_file=candidate.preset_file):
+        last = event
+    elapsed = time.monotonic() - started
+    return last.avg_fps if last is not None and last.avg_fps else seconds * source.fps / elapsed
+
+
+def calibration_key(source: SourceInfo) -> str:
+    return f"{source.width}x{source.height} {source.codec} {socket.gethostname()}"
+
+
+def load_calibrations(path: Optional[pathlib.Path] = None) -> Dict[str, Dict[str, Any]]:
+    path = path or calibration_file
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+async def calibrate(input, target_speed: float = 1.0, samples: int = 3, sample_length: float = 10.0,
+                    choices: Optional[List[Candidate]] = None, cache: Optional[pathlib.Path] = None) -> Candidate:
+    """Picks the slowest candidate that still encodes the input at least target_speed times as fast as it plays.
+    A few short pieces spread over the input get encoded with every candidate, from the slowest on,
+    until one is fast enough, or the fastest one if none is.
+    The choice is remembered in the cache file for the resolution and codec of the input and this host,
+    so further inputs like it don't get calibrated again.
+    Inputs too short to take the samples from get the slowest candidate, they encode quickly with any of them.
+    :param choices The candidates, slowest first, by default candidates."""
+    choices = choices or candidates
+    cache = cache or calibration_file
+    source = await probe(input)
+    key = calibration_key(source)
+    lock = _calibrating.setdefault(key, asyncio.Lock())
+    async with lock:  # Inputs of the same kind wait for the first one instead of calibrating as well.
+        cached = load_calibrations(cache).get(key)
+        if cached is not None and cached['target_speed'] == target_speed:
+            for candidate in choices:
+                if candidate.name == cached['candidate']:
+                    return candidate
+        length = min(sample_length, source.duration / (samples + 1)) if source.duration else sample_length
+        if length < 1:
+            return choices[0]
+        starts = [source.duration * (number + 1) / (samples + 1) for number in range(samples)]
+        measured: Dict[str, float] = {}
+        chosen = choices[-1]
+        with tempfile.TemporaryDirectory() as folder:
+            for candidate in choices:
+                fps = min([await sample(input, candidate, start, length, source, pathlib.Path(folder))
+                           for start in starts])
+                measured[candidate.name] = fps
+                if fps >= source.fps * target_speed:
+                    chosen = candidate
+                    break
+        calibrations = load_calibrations(cache)
+        calibrations[key] = {'candidate': chosen.name, 'target_speed': target_speed, 'measured': measured}
+        cache.write_text(json.dumps(calibrations, indent=2))
+        return chosen
+
+
+# Inputs the batch mode converts, mp4 and m4v files count as converted already.
+video_extensions = {'.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.mpg', '.mpeg', '.ts', '.m2ts', '.mts', '.vob'}
+batch_cache_name = '.video_convert.json'
+encode_memory = 2 * 1024 ** 3  # About how much memory one HandBrakeCLI run needs.
+
+
+def find_videos(folder: pathlib.Path, recursive: bool = False) -> Iterator[pathlib.Path]:
+    """Yields the videos in the folder, and in all folders below it with recursive."""
+    folders = [folder]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        folders.append(pathlib.Path(entry.path))
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in video_extensions:
+                    yield pathlib.Path(entry.path)
+
+
+def available_memory() -> Optional[int]:
+    """How much memory new processes can get, including the page cache the kernel would give up for them."""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:  # Only the memory nothing uses at all, which leaves out the page cache.
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):  # Not available on every system
+        return None
+
+
+def batch_workers() -> int:
+    """How many encodes can run at once without fighting over the cores or running out of memory."""
+    workers = max((os.cpu_count() or 1) // encoder_threads, 1)
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, max(memory // encode_memory, 1))
+    return workers
+
+
+async def batch(folder, output_folder=None, recursive: bool = False, workers: Optional[int] = None,
+                report=None, cache=None, summary_interval: float = 10.0, **settings: Any) -> List[Dict[str, Any]]:
+    """Converts all videos in the folder, several at once.
+    Videos whose output already exists are skipped, and so are those the cache file lists as converted
+    with the same size and modification time, so an interrupted batch can simply be started again.
+    Outputs are written under a temporary name first, so a cancelled encode never looks finished.
+    Videos that would end up with the same output, like a.mkv and a.avi, get their extension added to it instead,
+    a-mkv.mp4 and a-avi.mp4.
+    :param output_folder Where the outputs go, with the same structure as the folder. Next to the inputs by default.
+    :param workers How many encodes run at once, see batch_workers for the default.
+    :param report Where to write the results as JSON.
+    :param cache The file remembering converted videos, .video_convert.json in the folder by default.
+    :param settings Passed on to convert, like preset, quality and speed.
+    :returns The result for every video, with its status converted, skipped or failed."""
+    folder = pathlib.Path(folder)
+    cache = pathlib.Path(cache) if cache else folder / batch_cache_name
+    done: Dict[str, Dict[str, Any]] = json.loads(cache.read_text()) if cache.exists() else {}
+    results: List[Dict[str, Any]] = []
+    todo = []
+    targets = {input: pathlib.Path(output_folder) / input.relative_to(folder) if output_folder else input
+               for input in find_videos(folder, recursive)}
+    claimed = collections.Counter(target.with_suffix('.mp4') for target in targets.values())
+    for input, target in sorted(targets.items()):
+        output = target.with_suffix('.mp4')
+        if claimed[output] > 1:
+            output = target.with_name(f"{target.stem}-{target.suffix.lstrip('.')}.mp4")
+        stat = input.stat()
+        entry = done.get(str(input))
+        if output.exists() or (entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime):
+            results.append({'input': str(input), 'output': str(output), 'status': 'skipped'})
+        else:
+            todo.append((input, output, stat))
+
+    workers = workers or batch_workers()
+    limit = asyncio.Semaphore(workers)
+    running: Dict[str, Progress] = {}
+    started = time.monotonic()
+    counts = {'converted': 0, 'failed': 0}
+
+    def summary() -> str:
+        finished = counts['converted'] + counts['failed']
+        percent = (finished + sum(event.percent for event in running.values()) / 100) / max(len(todo), 1) * 100
+        elapsed = time.monotonic() - started
+        eta = f", ETA {elapsed * (100 - percent) / percent / 60:.0f} min" if percent > 0 else ""
+        return (f"{percent:.1f} %: {counts['converted']} converted, {counts['failed']} failed, "
+                f"{len(running)} running, {len(todo) - finished - len(running)} waiting, "
+                f"{len(results) - finished} skipped{eta}")
+
+    async def run(input: pathlib.Path, output: pathlib.Path, stat: os.stat_result) -> None:
+        async with limit:
+            key = str(input)
+            running[key] = Progress(1, 1, 0.0)
+            partial = output.with_suffix('.part.mp4')
+            result: Dict[str, Any] = {'input': key, 'output': str(output)}
+            try:
+                output.parent.mkdir(parents=True, exist_ok=True)
+                stats = await convert(input, partial, on_progress=lambda event: running.__setitem__(key, event),
+                                      **settings)
+                partial.replace(output)
+            except Exception as error:
+                if partial.exists():
+                    partial.unlink()
+                counts['failed'] += 1
+                result.update(status='failed', error=str(error))
+            else:
+                counts['converted'] += 1
+                result.update(status='converted', seconds=stats.seconds, avg_fps=stats.avg_fps,
+                              input_bytes=stats.input_bytes, output_bytes=stats.output_bytes)
+                done[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'output': str(output)}
+                cache.write_text(json.dumps(done, indent=2))
+            finally:
+                del running[key]
+            results.append(result)
+            print(f"{result['status']}: {input}")
+
+    async def report_progress() -> None:
+        while True:
+            await asyncio.sleep(summary_interval)
+            print(summary())
+
+    print(f"Converting {len(todo)} videos with {workers} at once, skipping {len(results)}")
+    reporter = asyncio.ensure_future(report_progress())
+    try:
+        await asyncio.gather(*(run(*job) for job in todo))
+    finally:
+        reporter.cancel()
+    print(summary())
+    if report is not None:
+        pathlib.Path(report).write_text(json.dumps({'folder': str(folder), 'seconds': time.monotonic() - started,
+                                                    'workers': workers, **counts, 'skipped': len(results) - len(todo),
+                                                    'results': results}, indent=2))
+    return results
 
 
 async def main(input, output):
-    await convert(input, output)
+    def show(event: Progress) -> None:
+        eta = "" if event.eta is None else f", {event.fps} fps, ETA {event.eta // 60} min"
+        print(f"\r{event.percent:.1f} %{eta}", end="", flush=True)
+
+    stats = await convert(input, output, on_progress=show)
+    print(f"\nDone in {stats.seconds:.0f} seconds, {stats.avg_fps} fps on average")
 
 
 def getfiles():
@@ -29,8 +452,33 @@ def getfiles():
         if event == 'OK':
             asyncio.run(main(input[0], output[0]))
 
+
+def batch_main(arguments: List[str]) -> None:
+    parser = argparse.ArgumentParser(prog='video_convert.py', description="Converts all videos in a folder.")
+    parser.add_argument('folder')
+    parser.add_argument('-r', '--recursive', action='store_true', help="include the folders below it")
+    parser.add_argument('-o', '--output', help="the folder to write the outputs to, next to the inputs by default")
+    parser.add_argument('-j', '--workers', type=int, help="how many videos get converted at once")
+    parser.add_argument('--report', help="write the results to this JSON file")
+    parser.add_argument('--cache', help="the file remembering converted videos")
+    parser.add_argument('--preset', default='Fast 1080p30')
+    parser.add_argument('--quality', default="22.0")
+    parser.add_argument('--speed', default="slow")
+    options = parser.parse_args(arguments)
+    if not os.path.isdir(options.folder):
+        parser.error(f"{options.folder} is not a folder, convert a single video with: video_convert.py INPUT [OUTPUT]")
+    results = asyncio.run(batch(options.folder, options.output, options.recursive, options.workers, options.report,
+                                options.cache, preset=options.preset, quality=options.quality, speed=options.speed))
+    if any(result['status'] == 'failed' for result in results):
+        sys.exit(1)
+
+
 if __name__ == '__main__':
-    if len(sys.argv) == 3:
+    if len(sys.argv) == 3 and not os.path.isdir(sys.argv[1]):
         asyncio.run(main(sys.argv[1], sys.argv[2]))
+    elif len(sys.argv) == 2 and os.path.isfile(sys.argv[1]) and not sys.argv[1].lower().endswith('.mp4'):
+        asyncio.run(main(sys.argv[1], os.path.splitext(sys.argv[1])[0] + '.mp4'))
+    elif len(sys.argv) > 1:
+        batch_main(sys.argv[1:])
     else:
         getfiles()